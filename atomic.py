@@ -0,0 +1,28 @@
+'''
+Files replaced as a whole.
+
+The new content is written under a temporary name in the same directory and
+only then moved over the target, so a crash or an error while writing never
+leaves half a file behind. The temporary name is unique, so threads and
+processes writing the same target do not collide.
+'''
+
+import os
+import tempfile
+
+def writeTemporary(path, write):
+    # calls write(f) with a file opened 'wb+' next to path and returns its name,
+    # the caller passes it to os.replace when it is ready; removed if write fails
+    fd, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path)+'.',
+                                dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb+') as f:
+            write(f)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return temp
+
+def writeReplacing(path, write):
+    # writes path through a temporary file in one step
+    os.replace(writeTemporary(path, write), path)
@@ -0,0 +1,175 @@
+'''
+Crash recovery for the shapes being edited.
+
+Autosave observes the handles like the hit-test grid does. Every move is put
+on a queue, a background thread appends it to a journal and now and then
+compacts the journal into a snapshot (a one-character scene library). The UI
+thread never touches the disk. The thread keeps its own copy of the shapes,
+so writing a snapshot never reads objects the UI is changing.
+
+On startup recover() loads the snapshot and replays the journal over it.
+Journal records hold absolute positions, so replaying records that already
+made it into the snapshot is harmless, and a record cut short by a crash is
+ignored.
+'''
+
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+import model
+import scene
+
+RECORD = struct.Struct('<I24s2d')
+
+log = logging.getLogger(__name__)
+
+def copyShapes(shapes, types = scene.MODEL_TYPES):
+    # model shapes with the same attributes, handle positions and constraints
+    copies = []
+    table = model.HandleTable()
+    for shape in shapes:
+        copy = types[type(shape).__name__](shape.name, table)
+        copy.configure(**{attr: getattr(shape, attr) for attr in shape.attrs})
+        for handle in shape.getHandles():
+            other = copy.handles[handle.name]
+            other.setConstraints(handle.canx, handle.minx, handle.maxx, handle.cany, handle.miny, handle.maxy)
+            other.x, other.y = handle.x, handle.y
+        copies.append(copy)
+    return copies
+
+def applyRecord(shapes, record):
+    index, name, x, y = record
+    handle = shapes[index].handles[name]
+    handle.x, handle.y = x, y
+    handle.notifyMoved()
+
+class Autosave:
+    def __init__(self, path, compact_interval = 30, compact_records = 10000):
+        # path is the snapshot and journal file name without extension
+        self.snapshot_file = path+'.fms'
+        self.journal_file = path+'.journal'
+        self.compact_interval = compact_interval
+        self.compact_records = compact_records
+        self.shapes = []
+        self.shape_index = {}
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='autosave', daemon=True)
+        self.thread.start()
+
+    def recover(self, types = scene.MODEL_TYPES, table = None):
+        # shapes saved by an earlier session, or None; a damaged snapshot raises
+        # OSError or ValueError
+        if not os.path.exists(self.snapshot_file):
+            return None
+        library = scene.Library(self.snapshot_file)
+        try:
+            shapes = library.load(0, types, table)
+        finally:
+            library.close()
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                data = f.read()
+            for offset in range(0, len(data)-RECORD.size+1, RECORD.size):
+                index, name, x, y = RECORD.unpack_from(data, offset)
+                try:
+                    applyRecord(shapes, (index, scene.decode(name), x, y))
+                except (IndexError, KeyError, ValueError):
+                    # a record for other shapes, or garbage where a crash tore the file
+                    pass
+        return shapes
+
+    def track(self, shapes):
+        # called on the UI thread whenever the edited shapes are replaced
+        for shape in self.shapes:
+            for handle in shape.getHandles():
+                handle.removeObserver(self)
+        self.shapes = list(shapes)
+        self.shape_index = {id(shape): i for i, shape in enumerate(self.shapes)}
+        for shape in self.shapes:
+            for handle in shape.getHandles():
+                handle.addObserver(self)
+        self.queue.put(('reset', copyShapes(self.shapes)))
+
+    def handleMoved(self, handle):
+        self.queue.put(('move', (self.shape_index[id(handle.shape)], handle.name, handle.x, handle.y)))
+
+    def close(self):
+        # writes a final snapshot and waits for the thread
+        self.queue.put(('stop', None))
+        self.thread.join()
+
+    def run(self):
+        shapes = None
+        journal = None
+        # records journaled since the last snapshot, force asks for a snapshot right away
+        records = 0
+        force = False
+        # the last snapshot failed, it is retried once compact_interval has passed
+        failed = False
+        compacted = time.monotonic()
+        running = True
+        while running:
+            try:
+                messages = [self.queue.get(timeout=self.compact_interval)]
+            except queue.Empty:
+                messages = []
+            # everything queued meanwhile is written in one go
+            while True:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = []
+            for kind, value in messages:
+                if kind == 'move' and shapes is not None:
+                    try:
+                        applyRecord(shapes, value)
+                        index, name, x, y = value
+                        data.append(RECORD.pack(index, scene.encode(name, 24), x, y))
+                    except Exception:
+                        log.exception('Could not autosave the move %r', value)
+                elif kind == 'reset':
+                    # earlier moves belong to the old shapes and are dropped with them
+                    shapes, data, force = value, [], True
+                elif kind == 'stop':
+                    running = False
+            if shapes is None:
+                continue
+            # a failed write is reported and the thread carries on, the shapes copy
+            # stays current, so the next snapshot catches up
+            try:
+                if data:
+                    if journal is None:
+                        journal = open(self.journal_file, 'ab')
+                    journal.write(b''.join(data))
+                    journal.flush()
+                    records += len(data)
+            except Exception:
+                log.exception('Could not write the autosave journal %s', self.journal_file)
+                journal = None
+                force = True
+            due = (records or force) and time.monotonic()-compacted >= self.compact_interval
+            snapshot = due or (not failed and (force or records >= self.compact_records))
+            if snapshot or (not running and (records or force)):
+                compacted = time.monotonic()
+                try:
+                    if journal is not None:
+                        journal.close()
+                        journal = None
+                    scene.saveLibrary(self.snapshot_file, [(shapes[0].name if shapes else 'Untitled', shapes)])
+                    # the snapshot holds every journaled move now
+                    open(self.journal_file, 'wb').close()
+                except Exception:
+                    log.exception('Could not write the autosave snapshot %s', self.snapshot_file)
+                    # retried after compact_interval rather than on every message
+                    failed = True
+                    journal = None
+                else:
+                    records = 0
+                    force = failed = False
+        if journal is not None:
+            journal.close()
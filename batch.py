@@ -0,0 +1,94 @@
+'''
+Render every combination of a parameter sweep across a pool of processes.
+
+Usage:
+    python batch.py sweep.json -o out --size 400x400 --processes 8
+
+sweep.json describes one shape and the values to try for each attribute and handle:
+    {"type": "Proportion", "attrs": {"num_heads": [3, 7.5, 8, 9]}}
+    {"type": "Head", "handles": {"Jaw": [[35, 70], [40, 70], [45, 70]], "Eyes": [[20, 23], [24, 23]]}}
+Images are numbered in sweep order, so the output does not depend on the number of processes.
+'''
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+def expandSweep(sweep):
+    # one scene spec per combination, last axis varying fastest
+    axes = [('attrs', name, values) for name, values in sweep.get('attrs', {}).items()]
+    axes += [('handles', name, values) for name, values in sweep.get('handles', {}).items()]
+    for combination in itertools.product(*[values for _, _, values in axes]):
+        spec = {'type': sweep['type'], 'name': sweep.get('name', sweep['type']), 'attrs': {}, 'handles': {}}
+        for (group, name, _), value in zip(axes, combination):
+            spec[group][name] = value
+        yield spec
+
+# per worker state, created once by initWorker
+worker = None
+
+def initWorker(width, height, shaded, output):
+    global worker
+    import wx
+    import render
+    app = wx.App(False)
+    worker = (app, render.Renderer(width, height, shaded), output)
+
+def renderJob(job):
+    import render
+    index, spec = job
+    app, renderer, output = worker
+    file = os.path.join(output, render.sceneFile(spec, index))
+    renderer.save(render.createScene(spec), file)
+    return file
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Render a facemap parameter sweep to PNG files.')
+    parser.add_argument('sweep', help='JSON file describing the sweep')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    parser.add_argument('--size', default='400x400', help='image size as WIDTHxHEIGHT')
+    parser.add_argument('--unshaded', action='store_true', help='draw outlines only')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=64, help='scenes handed to a worker at a time')
+    args = parser.parse_args(argv)
+
+    with open(args.sweep) as f:
+        sweep = json.load(f)
+    w, h = args.size.lower().split('x')
+    initargs = (int(w), int(h), not args.unshaded, args.output)
+    os.makedirs(args.output, exist_ok=True)
+
+    jobs = enumerate(expandSweep(sweep))
+    count = 0
+    start = last_report = time.perf_counter()
+
+    def report(final = False):
+        elapsed = time.perf_counter() - start
+        print('%d images in %.1fs, %.1f images/s' % (count, elapsed, count/elapsed if elapsed else 0),
+              file=sys.stderr, end='\n' if final else '\r')
+
+    if args.processes > 1:
+        # workers start fresh instead of inheriting the parent's state
+        pool = multiprocessing.get_context('spawn').Pool(args.processes, initWorker, initargs)
+        files = pool.imap_unordered(renderJob, jobs, args.chunksize)
+    else:
+        pool = None
+        initWorker(*initargs)
+        files = map(renderJob, jobs)
+
+    for file in files:
+        count += 1
+        if time.perf_counter() - last_report > 1:
+            last_report = time.perf_counter()
+            report()
+    if pool:
+        pool.close()
+        pool.join()
+    report(True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+'''
+Rendering benchmarks.
+
+Usage:
+    python bench.py [-o results.json] [--min-time 0.5]
+
+Times Head.draw and Proportion.draw, full Viewport paints at several window and grid sizes,
+hover hit-testing with many shapes and startup (imports and time to the first paint), and
+prints the results as JSON. On Linux without a display a private Xvfb server is started, so
+no GPU or desktop session is needed.
+'''
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+PAINT_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+GRID_SIZES = [10, 25, 50]
+HOVER_SHAPES = [1, 10, 100, 1000]
+STARTUP_RUNS = 5
+# seconds a startup run may wait for its first paint
+STARTUP_TIMEOUT = 30
+
+# run in a fresh interpreter, prints milliseconds since the script started
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+def ms():
+    return round((time.perf_counter()-start)*1000, 2)
+result = {}
+import geometry, model
+result['import model'] = ms()
+import wx
+result['import wx'] = ms()
+import facemap
+result['import facemap'] = ms()
+app = wx.App(False)
+frame = facemap.MainFrame(None, title='Facemap startup', autosave_path=None)
+result['MainFrame'] = ms()
+frame.Show()
+deadline = start+%d
+while frame.viewport.first_paint is None:
+    if time.perf_counter() > deadline:
+        sys.exit('no paint within %d seconds')
+    wx.Yield()
+result['first paint'] = round((frame.viewport.first_paint-start)*1000, 2)
+print(json.dumps(result))
+''' % (STARTUP_TIMEOUT, STARTUP_TIMEOUT)
+
+def ensureDisplay():
+    if not sys.platform.startswith('linux') or os.environ.get('DISPLAY'):
+        return None
+    # Xvfb writes the display number it picked to the given fd
+    r, w = os.pipe()
+    server = subprocess.Popen(['Xvfb', '-displayfd', str(w), '-screen', '0', '3840x2160x24', '-nolisten', 'tcp'],
+                              pass_fds=(w,), stderr=subprocess.DEVNULL)
+    os.close(w)
+    with os.fdopen(r) as f:
+        display = f.readline().strip()
+    os.environ['DISPLAY'] = ':' + display
+    return server
+
+def timeIt(fn, min_time):
+    # call fn in growing batches until the batch takes at least min_time
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            per_call = elapsed/n
+            return {'us_per_call': round(per_call*1e6, 2), 'fps': round(1/per_call, 1), 'calls': n}
+        n *= 2
+
+def benchDraw(min_time):
+    import wx
+    from facemap import Head, Proportion, Palette
+
+    results = {}
+    bitmap = wx.Bitmap(400, 400)
+    dc = wx.MemoryDC(bitmap)
+    gc = wx.GraphicsContext.Create(dc)
+    gc.Translate(200, 200)
+    palette = Palette()
+    for shape in (Head('Head'), Proportion('Proportion')):
+        for shaded in (True, False):
+            name = '%s.draw/%s' % (type(shape).__name__, 'shaded' if shaded else 'unshaded')
+            results[name] = timeIt(lambda: shape.draw(palette, gc, shaded), min_time)
+            def uncached():
+                shape.invalidatePaths()
+                shape.draw(palette, gc, shaded)
+            results[name+'/uncached'] = timeIt(uncached, min_time)
+    del gc
+    dc.SelectObject(wx.NullBitmap)
+    return results
+
+def benchPaint(min_time):
+    import wx
+    from facemap import MainFrame
+
+    results = {}
+    # without autosave, so results do not depend on (or change) the last session
+    frame = MainFrame(None, title='Facemap benchmark', autosave_path=None)
+    frame.Show()
+    viewport = frame.viewport
+    for w, h in PAINT_SIZES:
+        frame.SetClientSize(w, h)
+        wx.Yield()
+        for gridsize in GRID_SIZES:
+            viewport.gridsize = gridsize
+            def paint():
+                viewport.Refresh()
+                viewport.Update()
+            def paintCold():
+                viewport.background_layer.invalidate()
+                viewport.image_layer.invalidate()
+                paint()
+            name = 'OnPaint/%dx%d/grid%d' % (w, h, gridsize)
+            results[name] = timeIt(paint, min_time)
+            results[name+'/cold'] = timeIt(paintCold, min_time)
+    frame.Destroy()
+    return results
+
+def benchHover(min_time):
+    import wx
+    from facemap import Head, Viewport
+
+    results = {}
+    rnd = random.Random(0)
+    state = wx.MouseState()
+    for n in HOVER_SHAPES:
+        frame = wx.Frame(None)
+        viewport = Viewport(frame, [Head('Head %d' % i) for i in range(n)])
+        points = [(rnd.uniform(-80, 80), rnd.uniform(-80, 120)) for _ in range(1000)]
+        def hover():
+            for x, y in points:
+                viewport.hitTest(x, y, state)
+        result = timeIt(hover, min_time)
+        # report per hit-test rather than per batch of points
+        per_call = result['us_per_call']/len(points)
+        results['hitTest/%d shapes' % n] = {'us_per_call': round(per_call, 3), 'fps': round(1e6/per_call, 1),
+                                            'calls': result['calls']*len(points)}
+        frame.Destroy()
+    return results
+
+def benchStartup(runs):
+    # every run is a new process, so nothing is cached in memory; the median is reported
+    samples = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            # the script gives up by itself, the timeout catches a child stuck elsewhere
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], check=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True, timeout=2*STARTUP_TIMEOUT).stdout
+        except subprocess.CalledProcessError as error:
+            return {'error': 'startup run failed: %s' % (error.stderr.strip().splitlines() or [error])[-1]}
+        except subprocess.TimeoutExpired:
+            return {'error': 'startup run did not finish within %d seconds' % (2*STARTUP_TIMEOUT)}
+        wall = (time.perf_counter()-start)*1000
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process'] = round(wall, 2)
+        for name, value in result.items():
+            samples.setdefault(name, []).append(value)
+    return {name+' ms': sorted(values)[len(values)//2] for name, values in samples.items()}
+    
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark facemap rendering.')
+    parser.add_argument('-o', '--output', help='write the JSON results to this file')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent on each measurement')
+    parser.add_argument('--startup-runs', type=int, default=STARTUP_RUNS, help='processes started to time startup')
+    args = parser.parse_args(argv)
+
+    # facemap loads its reference image relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    server = ensureDisplay()
+    try:
+        import wx
+        app = wx.App(False)
+        results = {
+            'wx': wx.version(),
+            'draw': benchDraw(args.min_time),
+            'paint': benchPaint(args.min_time),
+            'hover': benchHover(args.min_time),
+            'startup': benchStartup(args.startup_runs),
+        }
+    finally:
+        if server:
+            server.terminate()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text+'\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
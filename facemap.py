@@ -1,39 +1,122 @@
-
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
 import math
+import os
+import sys
+import tempfile
+import time
 import wx
 
-def rotate(px, py, angle, cx=0, cy=0):
-    r = math.radians(angle)
-    qx = cx + math.cos(r) * (px-cx) - math.sin(r) * (py-cy)
-    qy = cy + math.sin(r) * (px-cx) + math.cos(r) * (py-cy)
+import autosave
+import history
+import model
+import scene
+from geometry import Affine, overlaps
+from model import Handle, HandleGrid, HandleTable, UIElement
+from tiles import TileStore, imageSize, pruneCache
+
+def addPolyline(path, points, close = False):
+    points = iter(points)
+    path.MoveToPoint(*next(points))
+    for x, y in points:
+        path.AddLineToPoint(x, y)
+    if close:
+        path.CloseSubpath()
+        
+# mirrors the right side of a shape onto the left
+MIRROR = Affine.scaling(-1, 1)
     
-    return qx, qy
+# images with at least this many pixels are shown through a tiled, memory-mapped
+# cache; the file size is only used for formats whose header is not read
+TILED_MIN_PIXELS = 40*1000*1000
+TILED_MIN_BYTES = 16*1024*1024
+
+def useTiles(file):
+    size = imageSize(file)
+    if size is None:
+        return os.path.getsize(file) >= TILED_MIN_BYTES
+    return size[0]*size[1] >= TILED_MIN_PIXELS
     
-class UIElement:
-    def move(self, dx = 0, dy = 0, event=None):
-        pass
+def decodeImage(file):
+    # safe on a worker thread, bitmaps are only created by the image classes
+    if useTiles(file):
+        return TiledImage, TiledImage.openStore(file)
+    return Image, Image.decode(file)
     
-    def draw(self, gc):
-        pass
-        
-    def contains(self, x, y):
-        return False
-        
-    def scale(self, s=1, event=None):
-        pass
-        
-class Image(wx.Bitmap, UIElement):
-    def __init__(self, file, x, y):
-        image = wx.Image(file)
-        image = image.AdjustChannels(1,1,1,.4)
-        super().__init__(image)
+def loadImage(file, x, y):
+    cls, data = decodeImage(file)
+    return cls(file, x, y, data)
+    
+class ImageLoader:
+    # decodes images on worker threads and hands them to the UI thread
+    def __init__(self, workers = None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers or min(4, os.cpu_count() or 1))
+        # set by shutdown, results that arrive later are dropped
+        self.closed = False
+        
+    def load(self, file, x, y, callback):
+        # returns a placeholder now, callback(placeholder, image or None) runs on the UI thread later
+        placeholder = PlaceholderImage(file, x, y)
+        future = self.executor.submit(decodeImage, file)
+        def done(future):
+            # runs on the worker thread, or right here if shutdown cancelled the future
+            if future.cancelled() or self.closed or not wx.GetApp():
+                return
+            wx.CallAfter(self.finish, placeholder, future, callback)
+        future.add_done_callback(done)
+        return placeholder
+        
+    def finish(self, placeholder, future, callback):
+        if self.closed:
+            return
+        try:
+            cls, data = future.result()
+        except concurrent.futures.CancelledError:
+            return
+        except (OSError, ValueError) as error:
+            wx.LogError('Could not load %s: %s' % (placeholder.file, error))
+            callback(placeholder, None)
+            return
+        # the placeholder may have been moved while the image was loading
+        image = cls(placeholder.file, placeholder.bitmapx, placeholder.bitmapy, data)
+        callback(placeholder, image)
+        
+    def shutdown(self):
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+class ReferenceImage(UIElement):
+    # placement of a reference image and an LRU cache of the bitmaps drawn for it
+    
+    # bytes of cached bitmaps kept around, least recently drawn go first
+    cache_budget = 64*1024*1024
+    
+    def __init__(self, x, y, w, h):
         self.bitmapx, self.bitmapy = x, y
-        self.bitmapw = image.GetWidth()
-        self.bitmaph = image.GetHeight()
+        self.bitmapw, self.bitmaph = w, h
         self.bitmapwh = self.bitmapw/self.bitmaph
-        
-    def draw(self, gc):
-        gc.DrawBitmap(self, self.bitmapx, self.bitmapy, int(self.bitmapw), int(self.bitmaph))
+        # while settled is False (scaling in progress) only ready-made levels are drawn
+        self.settled = True
+        self.scaled = collections.OrderedDict()
+        self.scaled_bytes = 0
+        
+    def cachedBitmap(self, key, build):
+        bitmap = self.scaled.get(key)
+        if bitmap is not None:
+            self.scaled.move_to_end(key)
+            return bitmap
+        bitmap = build()
+        size = bitmap.GetWidth()*bitmap.GetHeight()*4
+        while self.scaled and self.scaled_bytes+size > self.cache_budget:
+            _, old = self.scaled.popitem(last=False)
+            self.scaled_bytes -= old.GetWidth()*old.GetHeight()*4
+        if size <= self.cache_budget:
+            self.scaled[key] = bitmap
+            self.scaled_bytes += size
+        return bitmap
         
     def move(self, dx = 0, dy = 0, event=None):
         if event.ControlDown():
@@ -47,92 +130,360 @@ class Image(wx.Bitmap, UIElement):
         if event.ControlDown():
             self.bitmaph += s
             self.bitmapw += s * self.bitmapwh
+            self.settled = False
+            
+    def getBounds(self):
+        return self.bitmapx, self.bitmapy, self.bitmapw, self.bitmaph
+        
+    def getState(self):
+        return self.bitmapx, self.bitmapy, self.bitmapw, self.bitmaph
+        
+    def setState(self, state):
+        self.bitmapx, self.bitmapy, self.bitmapw, self.bitmaph = state
     
-class Handle(UIElement):
-    def __init__(self, name, x, y):
-        self.name = name
-        self.x, self.y = x, y
-        self.rect = wx.Rect(x-5, y-5, 10, 10)
-        
-        self.canx = True
-        self.minx = -1000
-        self.maxx =  1000
-        self.cany = True
-        self.miny = -1000
-        self.maxy =  1000
+class PlaceholderImage(ReferenceImage):
+    # stands in for an image that is still loading
+    def __init__(self, file, x, y, w = 400, h = 300):
+        ReferenceImage.__init__(self, x, y, w, h)
+        self.file = file
+        self.brush = wx.Brush(wx.Colour(128,128,128,60))
+        
+    def draw(self, gc, scale = 1, view = None):
+        gc.SetPen(wx.NullPen)
+        gc.SetBrush(self.brush)
+        gc.DrawRectangle(self.bitmapx, self.bitmapy, self.bitmapw, self.bitmaph)
+        
+class Image(wx.Bitmap, ReferenceImage):
+    def __init__(self, file, x, y, image = None):
+        if image is None:
+            image = self.decode(file)
+        wx.Bitmap.__init__(self, image)
+        ReferenceImage.__init__(self, x, y, image.GetWidth(), image.GetHeight())
+        # mip chain, each level half the size of the one before, built when first needed
+        self.mips = [image]
+        
+    @staticmethod
+    def decode(file):
+        image = wx.Image(file)
+        if not image.IsOk():
+            raise ValueError('not a readable image')
+        return image.AdjustChannels(1,1,1,.4)
+        
+    def mip(self, w, h):
+        # smallest level that is still at least w x h
+        level = 0
+        while True:
+            if level+1 == len(self.mips):
+                image = self.mips[level]
+                if image.GetWidth() < 2 or image.GetHeight() < 2:
+                    return level
+                self.mips.append(image.Scale(image.GetWidth()//2, image.GetHeight()//2,
+                                             wx.IMAGE_QUALITY_BOX_AVERAGE))
+            smaller = self.mips[level+1]
+            if smaller.GetWidth() < w or smaller.GetHeight() < h:
+                return level
+            level += 1
+            
+    def bitmapFor(self, w, h):
+        # bitmap to draw at w x h device pixels, enlarging is left to the backend
+        level = self.mip(w, h)
+        if level == 0 and (not self.settled or w >= self.GetWidth()):
+            return self
+        image = self.mips[level]
+        if not self.settled or (w, h) == (image.GetWidth(), image.GetHeight()):
+            return self.cachedBitmap(('mip', level), lambda: wx.Bitmap(image))
+        return self.cachedBitmap((w, h), lambda: wx.Bitmap(image.Scale(w, h, wx.IMAGE_QUALITY_HIGH)))
+        
+    def draw(self, gc, scale = 1, view = None):
+        w, h = int(self.bitmapw), int(self.bitmaph)
+        pw, ph = max(1, round(w*scale)), max(1, round(h*scale))
+        gc.DrawBitmap(self.bitmapFor(pw, ph), self.bitmapx, self.bitmapy, w, h)
+        
+class TiledImage(ReferenceImage):
+    # For scans too large to decode on every start. The pixels live in a
+    # memory-mapped tile cache, only tiles in view are turned into bitmaps.
+    cache_budget = 256*1024*1024
+    # bytes of tile caches kept on disk, the least recently used beyond it are deleted
+    disk_budget = 2*1024*1024*1024
+    tile = 256
     
-    def setConstraints(self, canx = True, minx = -1000, maxx =  1000, cany = True, miny = -1000, maxy =  1000):
-        self.canx = canx
-        self.minx = minx
-        self.maxx = maxx
-        self.cany = cany
-        self.miny = miny
-        self.maxy = maxy
+    def __init__(self, file, x, y, store = None):
+        self.store = store or self.openStore(file)
+        ReferenceImage.__init__(self, x, y, self.store.width, self.store.height)
+        
+    @staticmethod
+    def cacheFile(file):
+        stat = os.stat(file)
+        key = '%s|%d|%d' % (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+        return os.path.join(tempfile.gettempdir(), 'facemap-tiles',
+                            hashlib.sha1(key.encode()).hexdigest()+'.tiles')
+        
+    @classmethod
+    def openStore(cls, file):
+        path = cls.cacheFile(file)
+        if os.path.exists(path):
+            try:
+                return TileStore(path)
+            except (OSError, ValueError):
+                pass
+        # decoded once, later runs only map the cache file
+        image = wx.Image(file)
+        if not image.IsOk():
+            raise ValueError('not a readable image')
+        images = [image]
+        while max(image.GetWidth(), image.GetHeight()) > cls.tile:
+            image = image.Scale(max(1, image.GetWidth()//2), max(1, image.GetHeight()//2),
+                                wx.IMAGE_QUALITY_BOX_AVERAGE)
+            images.append(image)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = TileStore.create(path, [(image.GetWidth(), image.GetHeight(), image.GetDataBuffer())
+                                        for image in images], cls.tile)
+        pruneCache(os.path.dirname(path), cls.disk_budget)
+        return store
+        
+    def tileBitmap(self, level, tx, ty):
+        w, h, data = self.store.tileData(level, tx, ty)
+        return wx.Bitmap(wx.Image(w, h, data).AdjustChannels(1,1,1,.4))
+        
+    def draw(self, gc, scale = 1, view = None):
+        # view is the visible (x, y, w, h) in world coordinates
+        levels = self.store.levels
+        level = 0
+        while level+1 < len(levels) and levels[level+1][0] >= self.bitmapw*scale:
+            level += 1
+        # world units per tile on this level
+        size = self.store.tile
+        tw, th = self.bitmapw/levels[level][0]*size, self.bitmaph/levels[level][1]*size
+        cols, rows = self.store.tileCount(level)
+        x0, y0, x1, y1 = 0, 0, cols, rows
+        if view is not None:
+            vx, vy, vw, vh = view
+            x0, x1 = max(0, int((vx-self.bitmapx)//tw)), min(cols, math.ceil((vx+vw-self.bitmapx)/tw))
+            y0, y1 = max(0, int((vy-self.bitmapy)//th)), min(rows, math.ceil((vy+vh-self.bitmapy)/th))
+        for ty in range(y0, y1):
+            for tx in range(x0, x1):
+                bitmap = self.cachedBitmap((level, tx, ty), lambda: self.tileBitmap(level, tx, ty))
+                gc.DrawBitmap(bitmap, self.bitmapx+tx*tw, self.bitmapy+ty*th,
+                              bitmap.GetWidth()/size*tw, bitmap.GetHeight()/size*th)
+        
+class DrawBatch:
+    # Stands in for a GraphicsContext while a shape draws. Consecutive lines,
+    # ellipses and stroked paths that share the pen and brush are merged into
+    # one path and drawn with a single call. Primitives are only merged when
+    # their boxes do not overlap: where two strokes cross, drawing them
+    # separately blends the antialiased edges twice, so merging would change
+    # the pixels.
     
-    def canMoveX(self, delta = 0):
-        if self.canx and self.x+delta >= self.minx and self.x+delta <= self.maxx:
-            return True
-        else:
-            return False
-            
-    def canMoveY(self, delta = 0):
-        if self.cany and self.y+delta >= self.miny and self.y+delta <= self.maxy:
-            return True
-        else:
-            return False
+    # backend calls saved by all batches, read by the profiler
+    calls_saved = 0
     
-    def moveX(self, delta = 0):
-        if self.canMoveX(delta):
-            self.x += delta
-        self.rect = wx.Rect(self.x-5, self.y-5, 10, 10)
+    def __init__(self, gc):
+        self.gc = gc
+        self.pen = self.brush = None
+        self.opaque = True
+        self.path = None
+        self.filled = False
+        self.boxes = []
+        
+    def __getattr__(self, name):
+        # anything not batched is drawn in order, after what is pending
+        self.Flush()
+        return getattr(self.gc, name)
+        
+    def CreatePath(self):
+        return self.gc.CreatePath()
+        
+    def SetPen(self, pen):
+        if pen is not self.pen:
+            self.Flush()
+            self.pen = pen
+            self.opaque = not pen.IsOk() or pen.GetColour().Alpha() == 255
+            self.gc.SetPen(pen)
             
-    def moveY(self, delta = 0):
-        if self.canMoveY(delta):
-            self.y += delta
-        self.rect = wx.Rect(self.x-5, self.y-5, 10, 10)
+    def SetBrush(self, brush):
+        if brush is not self.brush:
+            # strokes do not use the brush
+            if self.filled:
+                self.Flush()
+            self.brush = brush
+            self.gc.SetBrush(brush)
             
-    def move(self, dx = 0, dy = 0, event=None):
-        self.moveX(dx)
-        self.moveY(dy)
-        
-    def contains(self, x, y):
-        return self.rect.Contains(x,y)
+    def add(self, filled, box):
+        # the outline reaches half the pen width outside the box, on both sides,
+        # plus a pixel of antialiasing
+        margin = self.pen.GetWidth()+1 if self.pen is not None and self.pen.IsOk() else 1
+        x, y, w, h = box
+        box = (x-margin/2, y-margin/2, w+margin, h+margin)
+        if self.path is not None:
+            if filled != self.filled or not self.opaque:
+                self.Flush()
+            elif any(overlaps(box, other) for other in self.boxes):
+                self.Flush()
+        if self.path is None:
+            self.path = self.gc.CreatePath()
+            Drawable.paths_created += 1
+            self.filled = filled
+            self.boxes = []
+            self.count = 0
+        self.boxes.append(box)
+        self.count += 1
+        return self.path
+        
+    def StrokeLine(self, x1, y1, x2, y2):
+        path = self.add(False, (min(x1, x2), min(y1, y2), abs(x2-x1), abs(y2-y1)))
+        path.MoveToPoint(x1, y1)
+        path.AddLineToPoint(x2, y2)
+        
+    def DrawEllipse(self, x, y, w, h):
+        filled = self.brush is not None and self.brush.IsOk()
+        self.add(filled, (x, y, w, h)).AddEllipse(x, y, w, h)
+        
+    def StrokePath(self, path):
+        box = path.GetBox()
+        self.add(False, (box.x, box.y, box.width, box.height)).AddPath(path)
+        
+    def FillPath(self, path):
+        self.Flush()
+        self.gc.FillPath(path)
+        
+    def DrawPath(self, path):
+        self.Flush()
+        self.gc.DrawPath(path)
+        
+    def Flush(self):
+        path = self.path
+        if path is None:
+            return
+        self.path = None
+        if self.filled:
+            # the subpaths do not overlap, so every one is filled as if drawn alone
+            self.gc.DrawPath(path, wx.WINDING_RULE)
+        else:
+            self.gc.StrokePath(path)
+        DrawBatch.calls_saved += self.count-1
+        self.filled = False
         
-    def draw(self, gc):
-        gc.DrawRoundedRectangle(self.x-5, self.y-5, 10, 10, 3)
+class Drawable:
+    # drawing on top of a model.Shape, with the shape's graphics paths cached by name
+    
+    # path name -> names of the handles the path is built from
+    path_deps = {}
+    # number of graphics paths created while painting, for the shape caches,
+    # draw batches and the grid, read by the profiler
+    paths_created = 0
+    # on-screen heights in pixels below which drawBlockIn is used instead,
+    # with level 1 below the first and level 2 below the second
+    lod_sizes = (80, 12)
+    
+    def __init__(self, *args, **kw):
+        self.paths = {}
+        super().__init__(*args, **kw)
         
-class Shape:
-    def __init__(self, name):
-        self.name = name
-        self.handles = {}
+    def handleMoved(self, handle):
+        for key, deps in self.path_deps.items():
+            if handle.name in deps:
+                self.paths.pop(key, None)
+        super().handleMoved(handle)
+                
+    def invalidatePaths(self, *keys):
+        if keys:
+            for key in keys:
+                self.paths.pop(key, None)
+        else:
+            self.paths.clear()
+            
+    def getPath(self, gc, key, build):
+        path = self.paths.get(key)
+        if path is None:
+            path = gc.CreatePath()
+            build(path)
+            self.paths[key] = path
+            Drawable.paths_created += 1
+        return path
+        
+    def configure(self, **attrs):
+        super().configure(**attrs)
+        self.invalidatePaths()
+        
+    def detailLevel(self, scale):
+        bounds = self.getBounds()
+        if bounds is None:
+            return 0
+        size = bounds[3]*scale
+        return sum(1 for threshold in self.lod_sizes if size < threshold)
+        
+    def draw(self, pal, gc, shaded, scale=1):
+        batch = DrawBatch(gc)
+        level = self.detailLevel(scale)
+        if level:
+            self.drawBlockIn(pal, batch, shaded, level)
+        else:
+            self.drawDetail(pal, batch, shaded)
+        batch.Flush()
         
-    def addHandle(self, handle):
-        self.handles[handle.name] = handle
+    def drawDetail(self, pal, gc, shaded):
+        pass
         
-    def draw(self, vp, gc, shaded):
+    def drawBlockIn(self, pal, gc, shaded, level):
         pass
-    
-    def getHandles(self):
-        return self.handles.values()
         
-class Proportion(Shape):
-    def __init__(self, name):
-        super().__init__(name)
+class Proportion(Drawable, model.Proportion):
+    def buildHandsPath(self, path):
+        s = self.size
+        hand_x, hand_y = self.armTransform().apply(2*s/3, 0)
+        hand = Affine.translation(hand_x, hand_y) @ Affine.rotation(-25)
+        points = [(s/8, 0), (-s/8, 0), (-s/8, s-s/4), (0, s-s/8), (s/6, s-s/2)]
+        for transform in (MIRROR @ hand, hand):
+            addPolyline(path, transform.transform(points), close=True)
+        
+    def buildFeetPath(self, path):
+        s = self.size
+        foot_x, foot_y = s/2-s/8, self.num_heads/2*s
+        foot = Affine.translation(foot_x, foot_y)
+        points = [(-s/7, s/8), (0, s/8), (s/4, s/6), (s/4, s/4), (-s/7, s/4), (-s/7, s/6),
+                  (-s/9, 0), (s/9, 0), (s/4, s/6)]
+        for transform in (foot, MIRROR @ foot):
+            addPolyline(path, transform.transform(points))
+        
+    def drawBlockIn(self, pal, gc, shaded, level):
+        s = self.size
+        gc.SetBrush(wx.NullBrush)
+        gc.SetPen(pal.BLACK_PEN)
+        
+        foot_x, foot_y = s/2-s/8, self.num_heads/2*s
+        gc.DrawEllipse(-s/2+s/6, self.start_y, 2*s/3, s)
+        if level > 1:
+            gc.StrokeLine(0, self.start_y+s, 0, foot_y)
+            return
+            
+        # torso
+        gc.DrawEllipse(-s/2, self.start_y+s+s/3, s, s+s/2+s/6)
+        gc.DrawEllipse(-s/2, -s, s, s)
+        
+        # limbs as straight lines
+        shoulder_x = 2*s/3
+        hand_x, hand_y = self.armTransform().apply(shoulder_x, 0)
+        knee_x, knee_y = s/2-s/8, self.num_heads/4*s+s/8
+        gc.StrokeLine(-shoulder_x, self.shoulder_y, shoulder_x, self.shoulder_y)
+        gc.StrokeLine(-shoulder_x, self.shoulder_y, -hand_x, hand_y)
+        gc.StrokeLine(shoulder_x, self.shoulder_y, hand_x, hand_y)
+        gc.StrokeLine(-s/2, s/8, -knee_x, knee_y)
+        gc.StrokeLine(s/2, s/8, knee_x, knee_y)
+        gc.StrokeLine(-knee_x, knee_y, -foot_x, foot_y)
+        gc.StrokeLine(knee_x, knee_y, foot_x, foot_y)
         
-        self.size = 20
-        self.num_heads = 8
-        self.start_y = -int(self.size*self.num_heads/2)
-        self.shoulder_y = self.start_y + self.size + self.size/2
+        # ground
+        gc.StrokeLine(-100, -self.start_y+s/4, 100, -self.start_y+s/4)
         
-    def draw(self, vp, gc, shaded):
+    def drawDetail(self, pal, gc, shaded):
         gc.SetBrush(wx.NullBrush)
-        gc.SetPen(vp.TBLACK_PEN_100)
+        gc.SetPen(pal.TBLACK_PEN_100)
         '''
         # draw circles
         for y in range(self.start_y, -self.start_y, self.size):
             gc.DrawEllipse(-self.size/2, y, self.size, self.size)
         '''
-        gc.SetPen(vp.BLACK_PEN)
+        gc.SetPen(pal.BLACK_PEN)
         
         # ground
         gc.StrokeLine(-100, -self.start_y+self.size/4, 100, -self.start_y+self.size/4)
@@ -157,38 +508,20 @@ class Proportion(Shape):
         gc.DrawEllipse(shoulder_x-self.size/8, self.shoulder_y-self.size/8, self.size/4, self.size/4)
         
         # draw arms
-        hand_x, hand_y = rotate(shoulder_x, 0, -25, shoulder_x, self.shoulder_y)
+        (hand_x, hand_y), (elbow_x, elbow_y) = self.armTransform().transform(
+            [(shoulder_x, 0), (shoulder_x, self.shoulder_y/2)])
         gc.StrokeLine(-shoulder_x, self.shoulder_y, -hand_x, hand_y)
         gc.StrokeLine(shoulder_x, self.shoulder_y, hand_x, hand_y)
         
         # elbow
-        elbow_x, elbow_y = rotate(shoulder_x, self.shoulder_y/2, -25, shoulder_x, self.shoulder_y)
         gc.DrawEllipse(-elbow_x-self.size/8, elbow_y, self.size/4, self.size/4)
         gc.DrawEllipse(elbow_x-self.size/8, elbow_y, self.size/4, self.size/4)
         
         # hands
         #gc.DrawEllipse(-hand_x-self.size/4, hand_y, self.size/2, self.size/2)
         #gc.DrawEllipse(hand_x-self.size/4, hand_y, self.size/2, self.size/2)
-        path = gc.CreatePath()
-        path.MoveToPoint(self.size/8, 0)
-        path.AddLineToPoint(-self.size/8, 0)
-        path.AddLineToPoint(-self.size/8, self.size-self.size/4)
-        path.AddLineToPoint(0, self.size-self.size/8)
-        path.AddLineToPoint(self.size/6, self.size-self.size/2)
-        path.CloseSubpath()
-        
-        gc.PushState()
-        gc.Scale(-1, 1)
-        gc.Translate(hand_x, hand_y)
-        gc.Rotate(math.radians(-25))
-        gc.StrokePath(path)
-        gc.PopState()
-        
-        gc.PushState()
-        gc.Translate(hand_x, hand_y)
-        gc.Rotate(math.radians(-25))
-        gc.StrokePath(path)
-        gc.PopState()
+        # hand outlines are kept in world space, so they batch with the rest
+        gc.StrokePath(self.getPath(gc, 'hands', self.buildHandsPath))
         
         # draw legs
         gc.DrawEllipse(-self.size/2-self.size/8, 0, self.size/4, self.size/4)
@@ -209,149 +542,55 @@ class Proportion(Shape):
         # foot
         #gc.DrawEllipse(-self.size/2-self.size/8, self.num_heads/2*self.size, self.size/4, self.size/4)
         #gc.DrawEllipse(self.size/2-self.size/8, self.num_heads/2*self.size, self.size/4, self.size/4)
-        path = gc.CreatePath()
-        path.MoveToPoint(foot_x-self.size/7, foot_y+self.size/8)
-        path.AddLineToPoint(foot_x, foot_y+self.size/8)
-        path.AddLineToPoint(foot_x+self.size/4, foot_y+self.size/6)
-        path.AddLineToPoint(foot_x+self.size/4, foot_y+self.size/4)
-        path.AddLineToPoint(foot_x-self.size/7, foot_y+self.size/4)
-        path.AddLineToPoint(foot_x-self.size/7, foot_y+self.size/6)
-        path.AddLineToPoint(foot_x-self.size/9, foot_y)
-        path.AddLineToPoint(foot_x+self.size/9, foot_y)
-        path.AddLineToPoint(foot_x+self.size/4, foot_y+self.size/6)
-        
-        path.MoveToPoint(-foot_x+self.size/7, foot_y+self.size/8)
-        path.AddLineToPoint(-foot_x, foot_y+self.size/8)
-        path.AddLineToPoint(-foot_x-self.size/4, foot_y+self.size/6)
-        path.AddLineToPoint(-foot_x-self.size/4, foot_y+self.size/4)
-        path.AddLineToPoint(-foot_x+self.size/7, foot_y+self.size/4)
-        path.AddLineToPoint(-foot_x+self.size/7, foot_y+self.size/6)
-        path.AddLineToPoint(-foot_x+self.size/9, foot_y)
-        path.AddLineToPoint(-foot_x-self.size/9, foot_y)
-        path.AddLineToPoint(-foot_x-self.size/4, foot_y+self.size/6)
+        path = self.getPath(gc, 'feet', self.buildFeetPath)
         gc.StrokePath(path)
         
-class Head(Shape):
-    def __init__(self, name):
-        super().__init__(name)
-        
-        self.head_handle = Handle('Head Width', 50, 0)
-        self.head_handle.setConstraints(cany=False, minx=10)
-        self.addHandle(self.head_handle)
-        
-        self.jaw_handle = Handle('Jaw', 40, 70)
-        self.addHandle(self.jaw_handle)
-        
-        self.chin_width_handle = Handle('Chin Width', 20, 90)
-        self.addHandle(self.chin_width_handle)
-        
-        self.chin_handle = Handle('Chin', 0, 95)
-        self.addHandle(self.chin_handle)
-        
-        self.eyes_handle = Handle('Eyes', 22, 23)
-        self.addHandle(self.eyes_handle)
-        
-        self.nose_handle = Handle('Nose', 0, 55)
-        self.nose_handle.setConstraints(canx=False)
-        self.addHandle(self.nose_handle)
-        
-        self.mouth_handle = Handle('Mouth', 0, 66)
-        self.mouth_handle.setConstraints(canx=False)
-        self.addHandle(self.mouth_handle)
-        
-        self.hairline_handle = Handle('Hairline', 0, -30)
-        self.hairline_handle.setConstraints(canx=False)
-        self.addHandle(self.hairline_handle)
-        
-    def draw(self, vp, gc, shaded):
-        gc.SetBrush(wx.NullBrush)
-            
-        gc.SetPen(vp.BLACK_PEN)
-        
-        # head shape
-        path1 = gc.CreatePath()
-        path1.AddArc(0, 0, self.head_handle.x, math.radians(180), math.radians(0), True)
-        
-        
-        path1.AddLineToPoint(self.jaw_handle.x, self.jaw_handle.y)
-        path1.AddLineToPoint(self.chin_width_handle.x, self.chin_width_handle.y)
-        path1.AddLineToPoint(0, self.chin_handle.y)
-        path1.AddLineToPoint(-self.chin_width_handle.x, self.chin_width_handle.y)
-        path1.AddLineToPoint(-self.jaw_handle.x, self.jaw_handle.y)
+class Head(Drawable, model.Head):
+    path_deps = {
+        'head': ('Head Width', 'Jaw', 'Chin Width', 'Chin'),
+        'eyeball_r': ('Eyes',),
+        'eyeball_l': ('Eyes',),
+        'eyebrows': ('Eyes',),
+        'nose': ('Nose',),
+        'ears': ('Head Width', 'Eyes', 'Nose'),
+        'mouth_r': ('Eyes', 'Mouth'),
+        'mouth_l': ('Eyes', 'Mouth'),
+        'lip': ('Mouth',),
+        'hair': ('Hairline', 'Head Width'),
+    }
+    
+    def buildHeadPath(self, path):
+        path.AddArc(0, 0, self.head_handle.x, math.radians(180), math.radians(0), True)
+        
+        path.AddLineToPoint(self.jaw_handle.x, self.jaw_handle.y)
+        path.AddLineToPoint(self.chin_width_handle.x, self.chin_width_handle.y)
+        path.AddLineToPoint(0, self.chin_handle.y)
+        path.AddLineToPoint(-self.chin_width_handle.x, self.chin_width_handle.y)
+        path.AddLineToPoint(-self.jaw_handle.x, self.jaw_handle.y)
 
-        path1.CloseSubpath()
+        path.CloseSubpath()
         
-        if shaded:
-            gc.SetBrush(vp.SKIN_BASE_BRUSH)
-            gc.FillPath(path1)
-            
-            gc.SetBrush(vp.SKIN_LIT0_BRUSH)
-            path2 = gc.CreatePath()
-            path2.MoveToPoint(-42, -18)
-            path2.AddLineToPoint(-32, 12)
-            path2.AddLineToPoint(-14, 14)
-            path2.AddLineToPoint(-25, -40)
-            path2.CloseSubpath()
-            gc.FillPath(path2)
-            '''
-            gc.SetBrush(vp.SKIN_BASE_BRUSH)
-            path2 = gc.CreatePath()
-            path2.MoveToPoint(25, -40)
-            path2.AddLineToPoint(14, 14)
-            path2.AddLineToPoint(-14, 14)
-            path2.AddLineToPoint(-25, -40)
-            path2.CloseSubpath()
-            gc.FillPath(path2)
-            '''
-            '''
-            gc.SetBrush(gc.CreateLinearGradientBrush(-35, -25, 0, -27, wx.Colour(234,210,184), wx.Colour(222,191,162)))
-            path2 = gc.CreatePath()
-            path2.MoveToPoint(-33, -29)
-            path2.AddLineToPoint(-23, 13)
-            path2.AddLineToPoint(0, 14)
-            path2.AddLineToPoint(0, -40)
-            path2.CloseSubpath()
-            gc.FillPath(path2)
-            '''
-            gc.SetBrush(vp.SKIN_LIT2_BRUSH)
-            path2 = gc.CreatePath()
-            path2.MoveToPoint(42, -18)
-            path2.AddLineToPoint(32, 12)
-            path2.AddLineToPoint(14, 14)
-            path2.AddLineToPoint(25, -40)
-            path2.CloseSubpath()
-            gc.FillPath(path2)
-            '''
-            gc.SetBrush(gc.CreateLinearGradientBrush(0, -27, 35, -27, wx.Colour(222,191,162), wx.Colour(156,93,86)))
-            path2 = gc.CreatePath()
-            path2.MoveToPoint(30, -29)
-            path2.AddLineToPoint(23, 13)
-            path2.AddLineToPoint(0, 14)
-            path2.AddLineToPoint(0, -40)
-            path2.CloseSubpath()
-            gc.FillPath(path2)
-        '''
-        gc.StrokePath(path1)
-        gc.SetBrush(wx.NullBrush)
+    def buildLit0Path(self, path):
+        path.MoveToPoint(-42, -18)
+        path.AddLineToPoint(-32, 12)
+        path.AddLineToPoint(-14, 14)
+        path.AddLineToPoint(-25, -40)
+        path.CloseSubpath()
         
-        # eyes
-        gc.SetBrush(vp.GRAY_BRUSH_220)
-        gc.DrawEllipse(-self.eyes_handle.x-13, self.eyes_handle.y-4, 25, 8)
-        gc.DrawEllipse(self.eyes_handle.x-13, self.eyes_handle.y-4, 25, 8)
+    def buildLit2Path(self, path):
+        path.MoveToPoint(42, -18)
+        path.AddLineToPoint(32, 12)
+        path.AddLineToPoint(14, 14)
+        path.AddLineToPoint(25, -40)
+        path.CloseSubpath()
         
-        # eye balls
-        gc.SetBrush(vp.BLACK_BRUSH)
-        path = gc.CreatePath()
+    def buildRightEyeballPath(self, path):
         path.AddArc(self.eyes_handle.x, self.eyes_handle.y-2, 6, math.radians(180), math.radians(0), False)
-        gc.DrawPath(path)
-        path = gc.CreatePath()
+        
+    def buildLeftEyeballPath(self, path):
         path.AddArc(-self.eyes_handle.x, self.eyes_handle.y-2, 6, math.radians(180), math.radians(0), False)
-        gc.DrawPath(path)
-        gc.SetBrush(wx.NullBrush)
         
-        # eyebrows
-        gc.SetBrush(vp.GRAY_BRUSH_50)
-        path = gc.CreatePath()
+    def buildEyebrowsPath(self, path):
         path.MoveToPoint(-self.eyes_handle.x-18, self.eyes_handle.y-2)
         path.AddLineToPoint(-self.eyes_handle.x-11, self.eyes_handle.y-10)
         path.AddLineToPoint(-self.eyes_handle.x+13, self.eyes_handle.y-7)
@@ -365,11 +604,8 @@ class Head(Shape):
         path.AddLineToPoint(self.eyes_handle.x-11, self.eyes_handle.y-11)
         path.AddLineToPoint(self.eyes_handle.x+11, self.eyes_handle.y-14)
         path.CloseSubpath()
-        gc.DrawPath(path)
-        gc.SetBrush(wx.NullBrush)
         
-        # nose
-        path = gc.CreatePath()
+    def buildNosePath(self, path):
         path.MoveToPoint(-4, self.nose_handle.y)
         path.AddLineToPoint(4, self.nose_handle.y)
         
@@ -381,15 +617,7 @@ class Head(Shape):
         path.AddLineToPoint(-12, self.nose_handle.y-4)
         path.AddLineToPoint(-8, self.nose_handle.y-10)
         
-        gc.StrokePath(path)
-        
-        gc.SetBrush(vp.GRAY_BRUSH_50)
-        gc.DrawEllipse(2, self.nose_handle.y-3, 5, 2)
-        gc.DrawEllipse(-7, self.nose_handle.y-3, 5, 2)
-        gc.SetBrush(wx.NullBrush)
-        
-        # ears
-        path = gc.CreatePath()
+    def buildEarsPath(self, path):
         path.MoveToPoint(self.head_handle.x, self.eyes_handle.y)
         path.AddLineToPoint(self.head_handle.x+4, self.eyes_handle.y-4)
         path.AddLineToPoint(self.head_handle.x+8, self.eyes_handle.y-4)
@@ -404,36 +632,20 @@ class Head(Shape):
         path.AddLineToPoint(-self.head_handle.x-4, self.eyes_handle.y+20)
         path.AddLineToPoint(-self.head_handle.x+4, self.nose_handle.y)
         
-        if shaded:
-            gc.SetBrush(vp.SKIN_BASE_BRUSH)
-            gc.DrawPath(path)
-            gc.SetBrush(wx.NullBrush)
-        else:
-            gc.StrokePath(path)
-            
-        # mouth
-        path = gc.CreatePath()
+    def buildRightMouthPath(self, path):
         path.MoveToPoint(0, self.mouth_handle.y)
         path.AddLineToPoint(5, self.mouth_handle.y-2)
         path.AddLineToPoint(self.eyes_handle.x-6, self.mouth_handle.y)
-        gc.DrawEllipse(self.eyes_handle.x-6, self.mouth_handle.y-2, 4, 2)
-        gc.StrokePath(path)
         
-        path = gc.CreatePath()
+    def buildLeftMouthPath(self, path):
         path.MoveToPoint(0, self.mouth_handle.y)
         path.AddLineToPoint(-5, self.mouth_handle.y-2)
         path.AddLineToPoint(-self.eyes_handle.x+6, self.mouth_handle.y)
-        gc.DrawEllipse(-self.eyes_handle.x+2, self.mouth_handle.y-2, 4, 2)
-        gc.StrokePath(path)
         
-        path = gc.CreatePath()
+    def buildLipPath(self, path):
         path.AddArc(0, self.mouth_handle.y-10, 6, math.radians(140), math.radians(40), False)
-        gc.StrokePath(path)
-        
-        gc.StrokeLine(-8, self.mouth_handle.y+7, 8, self.mouth_handle.y+7)
         
-        # hair
-        path = gc.CreatePath()
+    def buildHairPath(self, path):
         path.MoveToPoint(0, self.hairline_handle.y)
         path.AddLineToPoint(-15, self.hairline_handle.y-5)
         path.AddLineToPoint(-30, self.hairline_handle.y+5)
@@ -451,43 +663,434 @@ class Head(Shape):
         
         path.CloseSubpath()
         
-        gc.SetBrush(vp.GRAY_BRUSH_50)
-        gc.DrawPath(path)
+    def drawBlockIn(self, pal, gc, shaded, level):
+        gc.SetPen(pal.BLACK_PEN)
+        gc.SetBrush(pal.SKIN_BASE_BRUSH if shaded else wx.NullBrush)
+        
+        # skull and jaw as one ellipse
+        w = self.head_handle.x
+        gc.DrawEllipse(-w, -w, 2*w, self.chin_handle.y+w)
+        gc.SetBrush(wx.NullBrush)
+        if level > 1:
+            return
+            
+        # eye, nose and mouth lines
+        eyes_x, eyes_y = self.eyes_handle.x, self.eyes_handle.y
+        gc.StrokeLine(-eyes_x-13, eyes_y, eyes_x+13, eyes_y)
+        gc.StrokeLine(-4, self.nose_handle.y, 4, self.nose_handle.y)
+        gc.StrokeLine(-eyes_x+6, self.mouth_handle.y, eyes_x-6, self.mouth_handle.y)
+        
+    def drawDetail(self, pal, gc, shaded):
+        gc.SetBrush(wx.NullBrush)
+            
+        gc.SetPen(pal.BLACK_PEN)
+        
+        # head shape
+        path1 = self.getPath(gc, 'head', self.buildHeadPath)
+        
+        if shaded:
+            gc.SetBrush(pal.SKIN_BASE_BRUSH)
+            gc.FillPath(path1)
+            
+            gc.SetBrush(pal.SKIN_LIT0_BRUSH)
+            gc.FillPath(self.getPath(gc, 'lit0', self.buildLit0Path))
+            
+            gc.SetBrush(pal.SKIN_LIT2_BRUSH)
+            gc.FillPath(self.getPath(gc, 'lit2', self.buildLit2Path))
+            
+        gc.StrokePath(path1)
+        gc.SetBrush(wx.NullBrush)
+        
+        # eyes
+        gc.SetBrush(pal.GRAY_BRUSH_220)
+        gc.DrawEllipse(-self.eyes_handle.x-13, self.eyes_handle.y-4, 25, 8)
+        gc.DrawEllipse(self.eyes_handle.x-13, self.eyes_handle.y-4, 25, 8)
+        
+        # eye balls
+        gc.SetBrush(pal.BLACK_BRUSH)
+        gc.DrawPath(self.getPath(gc, 'eyeball_r', self.buildRightEyeballPath))
+        gc.DrawPath(self.getPath(gc, 'eyeball_l', self.buildLeftEyeballPath))
+        gc.SetBrush(wx.NullBrush)
+        
+        # eyebrows
+        gc.SetBrush(pal.GRAY_BRUSH_50)
+        gc.DrawPath(self.getPath(gc, 'eyebrows', self.buildEyebrowsPath))
+        gc.SetBrush(wx.NullBrush)
+        
+        # nose
+        gc.StrokePath(self.getPath(gc, 'nose', self.buildNosePath))
+        
+        gc.SetBrush(pal.GRAY_BRUSH_50)
+        gc.DrawEllipse(2, self.nose_handle.y-3, 5, 2)
+        gc.DrawEllipse(-7, self.nose_handle.y-3, 5, 2)
+        gc.SetBrush(wx.NullBrush)
+        
+        # ears
+        path = self.getPath(gc, 'ears', self.buildEarsPath)
+        if shaded:
+            gc.SetBrush(pal.SKIN_BASE_BRUSH)
+            gc.DrawPath(path)
+            gc.SetBrush(wx.NullBrush)
+        else:
+            gc.StrokePath(path)
+            
+        # mouth
+        gc.DrawEllipse(self.eyes_handle.x-6, self.mouth_handle.y-2, 4, 2)
+        gc.StrokePath(self.getPath(gc, 'mouth_r', self.buildRightMouthPath))
+        
+        gc.DrawEllipse(-self.eyes_handle.x+2, self.mouth_handle.y-2, 4, 2)
+        gc.StrokePath(self.getPath(gc, 'mouth_l', self.buildLeftMouthPath))
+        
+        gc.StrokePath(self.getPath(gc, 'lip', self.buildLipPath))
+        
+        gc.StrokeLine(-8, self.mouth_handle.y+7, 8, self.mouth_handle.y+7)
+        
+        # hair
+        gc.SetBrush(pal.GRAY_BRUSH_50)
+        gc.DrawPath(self.getPath(gc, 'hair', self.buildHairPath))
         gc.SetBrush(wx.NullBrush)
         
+# shape classes by the type names used in scene files
+SHAPE_TYPES = {
+    'Head': Head,
+    'Proportion': Proportion,
+}
+    
+class Palette:
+    # brushes and pens shared by everything that draws shapes, each one is
+    # created the first time it is used
+    BRUSHES = {
+        'BLACK_BRUSH': (0,0,0),
+        'WHITE_BRUSH': (255,255,255),
+        'SKIN_LIT0_BRUSH': (234,210,184),
+        'SKIN_LIT2_BRUSH': (156,93,86),
+        'SKIN_BASE_BRUSH': (222,191,162),
+        'SKIN_SHADOW_BRUSH': (90,47,57),
+        'GRAY_BRUSH_50': (50,50,50),
+        'GRAY_BRUSH_200': (200,200,200),
+        'GRAY_BRUSH_220': (220,220,220),
+        'TGRAY_BRUSH_100': (100,100,100, 200),
+        'TBLUE_BRUSH_200': (150,150,220, 200),
+    }
+    PENS = {
+        'BLACK_PEN': (0,0,0),
+        'TBLACK_PEN_100': (0,0,0, 100),
+        'GRAY_PEN_100': (100,100,100),
+        'GRAY_PEN_130': (130,130,130),
+        'GRAY_PEN_150': (150,150,150),
+    }
+    
+    def __getattr__(self, name):
+        if name in self.BRUSHES:
+            value = wx.Brush(wx.Colour(*self.BRUSHES[name]))
+        elif name in self.PENS:
+            value = wx.Pen(wx.Colour(*self.PENS[name]))
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+        
+class Layer:
+    # off-screen bitmap for content that only changes when its key does
+    def __init__(self, render, transparent = False):
+        self.render = render
+        self.transparent = transparent
+        self.bitmap = None
+        self.key = None
+        
+    def invalidate(self):
+        self.key = None
+        
+    def update(self, w, h, key):
+        bitmap = self.bitmap
+        if bitmap and key == self.key and bitmap.GetSize() == (w, h):
+            return bitmap
+            
+        reused = bitmap and bitmap.GetSize() == (w, h)
+        if not reused:
+            bitmap = wx.Bitmap.FromRGBA(w, h) if self.transparent else wx.Bitmap(w, h)
+            
+        dc = wx.MemoryDC(bitmap)
+        gc = wx.GraphicsContext.Create(dc)
+        if reused and self.transparent:
+            # the old content has to go, not just be painted over
+            gc.SetCompositionMode(wx.COMPOSITION_CLEAR)
+            gc.DrawRectangle(0, 0, w, h)
+            gc.SetCompositionMode(wx.COMPOSITION_OVER)
+        self.render(gc, w, h)
+        # the context has to be gone before the bitmap is deselected
+        del gc
+        dc.SelectObject(wx.NullBitmap)
+        
+        self.bitmap = bitmap
+        self.key = key
+        return bitmap
+        
+    def draw(self, gc, w, h, key):
+        if w > 0 and h > 0:
+            gc.DrawBitmap(self.update(w, h, key), 0, 0, w, h)
+        
+class FrameScheduler:
+    # runs callback at most fps times a second, requests in between are coalesced
+    def __init__(self, window, callback, fps = 60):
+        self.callback = callback
+        self.fps = fps
+        self.pending = False
+        self.last_frame = 0
+        self.timer = wx.Timer(window)
+        window.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
+        
+    def request(self):
+        if self.pending:
+            return
+        self.pending = True
+        wait = self.last_frame + 1/self.fps - time.perf_counter() if self.fps else 0
+        if wait > 0:
+            self.timer.StartOnce(max(1, int(wait*1000)))
+        else:
+            self.frame()
+            
+    def flush(self):
+        if self.pending:
+            self.timer.Stop()
+            self.frame()
+            
+    def OnTimer(self, event):
+        if self.pending:
+            self.frame()
+            
+    def frame(self):
+        self.pending = False
+        self.last_frame = time.perf_counter()
+        self.callback()
+        
+class Profiler:
+    # per-frame timings, kept in a rolling buffer that can be dumped to a file
+    def __init__(self, size = 1000):
+        self.frames = collections.deque(maxlen=size)
+        self.sections = {}
+        self.events = collections.deque()
+        self.frame_start = self.last_frame = None
+        self.paths = Drawable.paths_created
+        self.calls_saved = DrawBatch.calls_saved
+        
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[name] = self.sections.get(name, 0) + time.perf_counter()-start
+            
+    def event(self):
+        self.events.append(time.perf_counter())
+        
+    def eventsPerSecond(self):
+        now = time.perf_counter()
+        while self.events and self.events[0] < now-1:
+            self.events.popleft()
+        return len(self.events)
+        
+    def beginFrame(self):
+        self.frame_start = time.perf_counter()
+        
+    def endFrame(self):
+        end = time.perf_counter()
+        # sections timed between two paints (e.g. hover) count towards the next frame
+        self.frames.append({
+            'time': time.time(),
+            'frame': self.frame_start-self.last_frame if self.last_frame else 0,
+            'paint': end-self.frame_start,
+            'sections': self.sections,
+            'events_per_second': self.eventsPerSecond(),
+            'paths_created': Drawable.paths_created-self.paths,
+            'calls_saved': DrawBatch.calls_saved-self.calls_saved,
+        })
+        self.last_frame = self.frame_start
+        self.sections = {}
+        self.paths = Drawable.paths_created
+        self.calls_saved = DrawBatch.calls_saved
+        
+    def summary(self, sections = 8):
+        if not self.frames:
+            return []
+        frame = self.frames[-1]
+        lines = ['Frame %.1f ms, paint %.2f ms' % (frame['frame']*1000, frame['paint']*1000)]
+        for name, t in sorted(frame['sections'].items(), key=lambda item: -item[1])[:sections]:
+            lines.append('    %s %.2f ms' % (name, t*1000))
+        lines.append('%d events/s, %d paths created, %d draw calls saved' % (
+            frame['events_per_second'], frame['paths_created'], frame['calls_saved']))
+        return lines
+        
+    def dump(self, file):
+        with open(file, 'w') as f:
+            for frame in self.frames:
+                f.write(json.dumps(frame)+'\n')
+        
+class Recorder:
+    # writes the input events a viewport handles to a JSON lines file, replay.py plays them back
+    KINDS = {
+        wx.wxEVT_MOTION: 'motion',
+        wx.wxEVT_MOUSEWHEEL: 'wheel',
+        wx.wxEVT_LEFT_UP: 'left_up',
+        wx.wxEVT_KEY_DOWN: 'key',
+    }
+    
+    def __init__(self, file, viewport):
+        self.file = open(file, 'w')
+        self.start = time.perf_counter()
+        # the first line holds what the events start from
+        w, h = viewport.GetClientSize()
+        self.write({
+            'version': 2,
+            'size': [w, h],
+            'panx': viewport.panx, 'pany': viewport.pany, 'zoom': viewport.zoom,
+            'shaded': viewport.shaded, 'background_image': viewport.background_image,
+            'gridsize': viewport.gridsize,
+            'mouse': [viewport.lastx, viewport.lasty],
+            'image': list(viewport.bgImage.getState()) if viewport.bgImage else None,
+            'shapes': [shapeSpec(shape) for shape in viewport.shapes],
+        })
+        
+    def write(self, record):
+        self.file.write(json.dumps(record)+'\n')
+        
+    def record(self, event):
+        kind = self.KINDS[event.GetEventType()]
+        record = {'t': round(time.perf_counter()-self.start, 6), 'type': kind,
+                  'mods': ''.join(flag for flag, down in (('C', event.ControlDown()), ('S', event.ShiftDown()),
+                                                          ('A', event.AltDown())) if down)}
+        if kind == 'key':
+            record['key'] = event.GetKeyCode()
+        else:
+            record['x'], record['y'] = event.GetPosition()
+            record['down'] = ''.join(flag for flag, down in (('L', event.LeftIsDown()), ('M', event.MiddleIsDown()),
+                                                             ('R', event.RightIsDown())) if down)
+        if kind == 'wheel':
+            record['rotation'] = event.GetWheelRotation()
+            record['delta'] = event.GetWheelDelta()
+            record['lines'] = event.GetLinesPerAction()
+        self.write(record)
+        
+    def close(self):
+        self.file.close()
+        
+def shapeSpec(shape):
+    # a scene spec as render.py reads it, plus the handle constraints
+    return {'type': type(shape).__name__, 'name': shape.name,
+            'attrs': {attr: getattr(shape, attr) for attr in shape.attrs},
+            'handles': {handle.name: [handle.x, handle.y] for handle in shape.getHandles()},
+            'constraints': {handle.name: [handle.canx, handle.minx, handle.maxx, handle.cany, handle.miny, handle.maxy]
+                            for handle in shape.getHandles()}}
+    
+def specShape(spec, table = None):
+    # the exact shape shapeSpec describes, positions are restored without applying constraints
+    shape = SHAPE_TYPES[spec['type']](spec['name'], table)
+    shape.configure(**spec.get('attrs', {}))
+    for name, constraints in spec.get('constraints', {}).items():
+        shape.handles[name].setConstraints(*constraints)
+    for name, position in spec.get('handles', {}).items():
+        shape.handles[name].setState(tuple(position))
+    return shape
+    
+class ViewGroup:
+    # What several viewports on the same shapes share: the shapes (and so their
+    # path caches), the hit-test grid, palette and undo history. Edits made in
+    # one viewport are passed on to the others so they repaint the same region.
+    def __init__(self, shapes):
+        self.shapes = shapes
+        self.palette = Palette()
+        self.history = history.History()
+        self.handle_index = HandleGrid()
+        for shape in self.shapes:
+            self.indexShape(shape)
+        self.viewports = []
+        
+    def indexShape(self, shape):
+        for handle in shape.getHandles():
+            self.handle_index.insert(handle)
+            
+    def setShapes(self, shapes):
+        for shape in self.shapes:
+            for handle in shape.getHandles():
+                self.handle_index.remove(handle)
+        # the list is shared with the frame
+        self.shapes[:] = shapes
+        for shape in self.shapes:
+            self.indexShape(shape)
+        self.history.clear()
+        for viewport in self.viewports:
+            viewport.hovered_element = None
+            viewport.damageAll()
+            viewport.flushDamage()
+            
+    def changed(self, source, rects):
+        # rects in world coordinates, None if everything changed
+        for viewport in self.viewports:
+            if viewport is source:
+                continue
+            if rects is None:
+                viewport.damageAll()
+            else:
+                for rect in rects:
+                    viewport.damage(rect)
+            viewport.flushDamage()
+            
 class Viewport( wx.Panel ):
-    def __init__(self, parent, shapes):
+    def __init__(self, parent, shapes, fps = 60, group = None):
         super().__init__(parent, wx.ID_ANY)
         
-        self.shapes = shapes
+        self.group = group or ViewGroup(shapes)
+        self.group.viewports.append(self)
+        self.shapes = self.group.shapes
         self.shaded = True
+        self.profiling = False
+        self.profiler = Profiler()
+        # input is written here while recording (F5)
+        self.recorder = None
+        self.paint_count = 0
         self.hovered_element = None
+        self.damaged = []
+        # damage to the shared shapes, the other viewports of the group repaint it too
+        self.model_damage = []
+        # a drag is one undo step, so is a run of wheel ticks ending gesture_delay ms apart
+        self.history = self.group.history
+        self.gesture_end = None
+        self.gesture_delay = 500
         
         self.lastx = self.lasty = 0
+        # motion accumulated since the last frame
+        self.motion_mode = None
+        self.motion_dx = self.motion_dy = 0
+        self.motion_state = wx.MouseState()
+        self.scheduler = FrameScheduler(self, self.applyMotion, fps)
         self.panx, self.pany = 200, 100
+        self.zoom = 1
+        self.min_zoom, self.max_zoom = 0.05, 20
         self.gridsize = 50
+        # every major_every-th grid line is a major line, minor lines closer than
+        # min_grid_spacing pixels are left out
+        self.major_every = 5
+        self.min_grid_spacing = 8
+        self.grid_key = self.grid_paths = None
     
-        self.BLACK_BRUSH = wx.Brush(wx.Colour(0,0,0))
-        self.WHITE_BRUSH = wx.Brush(wx.Colour(255,255,255))
-        self.SKIN_LIT0_BRUSH = wx.Brush(wx.Colour(234,210,184))
-        self.SKIN_LIT2_BRUSH = wx.Brush(wx.Colour(156,93,86))
-        self.SKIN_BASE_BRUSH = wx.Brush(wx.Colour(222,191,162))
-        self.SKIN_SHADOW_BRUSH = wx.Brush(wx.Colour(90,47,57))
-        self.GRAY_BRUSH_50 = wx.Brush(wx.Colour(50,50,50))
-        self.GRAY_BRUSH_200 = wx.Brush(wx.Colour(200,200,200))
-        self.GRAY_BRUSH_220 = wx.Brush(wx.Colour(220,220,220))
-        self.TGRAY_BRUSH_100 = wx.Brush(wx.Colour(100,100,100, 200))
-        self.TBLUE_BRUSH_200 = wx.Brush(wx.Colour(150,150,220, 200))
-        
-        self.BLACK_PEN = wx.Pen(wx.Colour(0,0,0))
-        self.TBLACK_PEN_100 = wx.Pen(wx.Colour(0,0,0, 100))
-        self.GRAY_PEN_100 = wx.Pen(wx.Colour(100,100,100))
-        self.GRAY_PEN_150 = wx.Pen(wx.Colour(150,150,150))
+        self.palette = self.group.palette
         
         self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
         
         self.background_image = False
-        self.bgImage = Image('facemap.jpg', -self.panx, -self.pany)
+        self.image_loader = ImageLoader()
+        self.bgImage = None
+        # the image is redrawn at its exact size once zooming or scaling stops
+        self.image_settle = None
+        self.image_settle_delay = 200
+        
+        self.background_layer = Layer(self.drawBackground)
+        self.image_layer = Layer(self.drawImage, transparent=True)
+        # time of the first paint, work that is not needed for it waits until then
+        self.first_paint = None
+        
+        self.handle_index = self.group.handle_index
         
         self.InitUI()
 
@@ -495,136 +1098,534 @@ class Viewport( wx.Panel ):
         self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
         self.Bind(wx.EVT_MOUSEWHEEL, self.OnMouseWheel)
         self.Bind(wx.EVT_MOTION, self.OnMouseMotion)
+        self.Bind(wx.EVT_LEFT_UP, self.OnLeftUp)
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
         
         self.font = self.GetFont()
         
+    def setShapes(self, shapes):
+        self.group.setShapes(shapes)
+            
+    def toWorld(self, x, y):
+        return (x-self.panx)/self.zoom, (y-self.pany)/self.zoom
+        
+    def zoomAt(self, x, y, factor):
+        # keep the world point under (x, y) in place
+        wx_, wy = self.toWorld(x, y)
+        self.zoom = min(max(self.zoom*factor, self.min_zoom), self.max_zoom)
+        self.panx, self.pany = x-wx_*self.zoom, y-wy*self.zoom
+        self.damageAll()
+        
+    def hitTest(self, x, y, event):
+        element = self.handle_index.query(x, y)
+        if not element and self.bgImage and self.bgImage.contains(x, y, event):
+            element = self.bgImage
+        return element
+        
+    def setFrameRate(self, fps):
+        # 0 disables the cap
+        self.scheduler.fps = fps
+        
     def OnKeyDown(self, event):
+        self.profiler.event()
+        self.scheduler.flush()
         keycode = event.GetKeyCode()
+        if self.recorder and keycode != wx.WXK_F5:
+            self.recorder.record(event)
         if keycode == wx.WXK_F1:
             self.background_image = not self.background_image
+            self.damageAll()
         elif keycode == wx.WXK_F2:
             self.shaded = not self.shaded
+            for shape in self.shapes:
+                self.damage(shape.getBounds())
+            self.damageOverlay()
+        elif keycode == wx.WXK_F3:
+            self.profiling = not self.profiling
+            self.damageAll()
+        elif keycode == wx.WXK_F4 and self.profiling:
+            self.profiler.dump('facemap-profile.jsonl')
+        elif keycode == ord('Z') and event.ControlDown():
+            self.undo(redo=event.ShiftDown())
+        elif keycode == ord('Y') and event.ControlDown():
+            self.undo(redo=True)
+        elif keycode == wx.WXK_F5:
+            if self.recorder:
+                self.recorder.close()
+                self.recorder = None
+            else:
+                self.recorder = Recorder('facemap-session.jsonl', self)
+            self.damageOverlay()
             
-        self.Refresh()
+        self.flushDamage()
+        
+    def damage(self, rect):
+        # rect is (x, y, w, h) in world coordinates, None means nothing visible changed
+        if rect is None or self.damaged is None:
+            return
+        x, y, w, h = rect
+        z = self.zoom
+        x, y = math.floor(x*z+self.panx), math.floor(y*z+self.pany)
+        self.damaged.append(wx.Rect(x-2, y-2, math.ceil(w*z)+5, math.ceil(h*z)+5))
+        
+    def damageAll(self):
+        self.damaged = None
+        
+    def damageOverlay(self):
+        if self.damaged is None:
+            return
+        lines = self.overlayText()
+        w = max(self.GetTextExtent(text)[0] for text in lines)
+        if self.profiling:
+            # leave room for the next frame's numbers
+            w = max(w, 300)
+        self.damaged.append(wx.Rect(8, 8, w+4, 15*len(lines)+5))
+        
+    def damageModel(self, rect):
+        self.damage(rect)
+        if rect is not None and self.model_damage is not None:
+            self.model_damage.append(rect)
+            
+    def damageModelAll(self):
+        self.damageAll()
+        self.model_damage = None
+        
+    def damageElement(self, element):
+        if isinstance(element, Handle):
+            self.damageModel(element.getBounds())
+            if element.shape:
+                self.damageModel(element.shape.getBounds())
+        elif element is self.bgImage and self.background_image:
+            self.damage(element.getBounds())
+            
+    def flushDamage(self):
+        if self.model_damage != []:
+            model_damage, self.model_damage = self.model_damage, []
+            self.group.changed(self, model_damage)
+        if self.damaged is None:
+            self.Refresh()
+        else:
+            if self.profiling and self.damaged:
+                self.damageOverlay()
+            for rect in self.damaged:
+                self.RefreshRect(rect, False)
+        self.damaged = []
+        
+    def overlayText(self):
+        lines = ['F1: '+('Hide Image' if self.background_image else 'Show Image'),
+                 'F2: '+('Shaded' if self.shaded else 'Unshaded'),
+                 'F3: '+('Hide Profile' if self.profiling else 'Show Profile'),
+                 'F5: '+('Stop Recording' if self.recorder else 'Record Input')]
+        if self.profiling:
+            lines.append('F4: Dump Profile')
+            lines += self.profiler.summary()
+        return lines
         
     def OnEraseBackground(self, event):
         pass
         
     def OnPaint(self, event):
+        profiler = self.profiler
+        profiler.beginFrame()
+        self.paint_count += 1
         dc = wx.AutoBufferedPaintDC(self)
         
         gc = wx.GraphicsContext.Create(dc)
         
-        # paint background
         w, h = gc.GetSize()
         w, h = int(w), int(h)
         
-        gc.SetBrush(self.GRAY_BRUSH_200)
-        gc.DrawRectangle(0,0,w,h)
-        
-        # draw secondary axis lines
-        gc.SetPen(self.GRAY_PEN_150)
-        for x in range(int(self.panx)%self.gridsize,w-1,self.gridsize):
-            gc.StrokeLine(x, 0, x, h)
-        for y in range(int(self.pany)%self.gridsize,h-1,self.gridsize):
-            gc.StrokeLine(0, y, w, y)
-        # draw main axis lines (horizontal and vertical)
-        gc.SetPen(self.GRAY_PEN_100)
-        gc.StrokeLine(0, self.pany, w, self.pany)
-        gc.StrokeLine(self.panx, 0, self.panx, h)
+        # background, grid and axes only change with the pan and the window size
+        with profiler.section('background'):
+            self.background_layer.draw(gc, w, h, (self.panx, self.pany, self.zoom, self.gridsize))
         
         gc.PushState()
-        # pan the viewport
+        # pan and zoom the viewport
         gc.Translate(self.panx, self.pany)
+        gc.Scale(self.zoom, self.zoom)
         
-        # draw shapes
+        # draw shapes, skipping those outside the area being repainted
+        box = self.GetUpdateRegion().GetBox()
+        x, y = self.toWorld(box.x-2, box.y-2)
+        view = (x, y, (box.width+4)/self.zoom, (box.height+4)/self.zoom)
         for shape in self.shapes:
-            shape.draw(self, gc, self.shaded)
+            bounds = shape.getBounds()
+            if bounds and not overlaps(bounds, view):
+                continue
+            with profiler.section('shape '+shape.name):
+                shape.draw(self.palette, gc, self.shaded, self.zoom)
             ''' # to draw all handles
             for handle in shape.getHandles():
                 if handle == self.hovered_element:
-                    gc.SetBrush(self.TBLUE_BRUSH_200)
+                    gc.SetBrush(self.palette.TBLUE_BRUSH_200)
                 else:
-                    gc.SetBrush(self.TGRAY_BRUSH_100)
+                    gc.SetBrush(self.palette.TGRAY_BRUSH_100)
                 handle.draw(gc)
             '''
-        if self.hovered_element and type(self.hovered_element)==Handle:
-            gc.SetBrush(self.TGRAY_BRUSH_100)
-            self.hovered_element.draw(gc)
+        with profiler.section('handles'):
+            if self.hovered_element and type(self.hovered_element)==Handle:
+                gc.SetBrush(self.palette.TGRAY_BRUSH_100)
+                self.hovered_element.draw(gc)
             
+        gc.PopState()
+        
         # draw bitmap
         if self.bgImage and self.background_image:
-            self.bgImage.draw(gc)
-        
-        gc.PopState()
+            image = self.bgImage
+            with profiler.section('bitmap'):
+                moving = self.motion_mode == 'pan' or (self.motion_mode == 'drag' and self.hovered_element is image)
+                if moving:
+                    # the layer would be rebuilt every frame, drawing directly is cheaper
+                    gc.PushState()
+                    self.drawImage(gc, w, h)
+                    gc.PopState()
+                else:
+                    self.image_layer.draw(gc, w, h, (self.panx, self.pany, self.zoom,
+                        image.bitmapx, image.bitmapy, image.bitmapw, image.bitmaph, image.settled))
         
         gc.SetFont(self.GetFont(), wx.Colour(0,0,0))
-        gc.DrawText('F1: '+('Hide Image' if self.background_image else 'Show Image'), 10, 10)
-        gc.DrawText('F2: '+('Shaded' if self.shaded else 'Unshaded'), 10, 25)
+        for i, text in enumerate(self.overlayText()):
+            gc.DrawText(text, 10, 10+15*i)
+            
+        profiler.endFrame()
+        
+        if self.first_paint is None:
+            self.first_paint = time.perf_counter()
+            wx.CallAfter(self.afterFirstPaint)
+        
+    def drawBackground(self, gc, w, h):
+        # paint background
+        gc.SetBrush(self.palette.GRAY_BRUSH_200)
+        gc.DrawRectangle(0,0,w,h)
+        
+        # draw secondary axis lines
+        with self.profiler.section('grid'):
+            minor, major = self.gridPaths(gc, w, h)
+            if minor is not None:
+                gc.SetPen(self.palette.GRAY_PEN_150)
+                gc.StrokePath(minor)
+            gc.SetPen(self.palette.GRAY_PEN_130)
+            gc.StrokePath(major)
+        # draw main axis lines (horizontal and vertical)
+        gc.SetPen(self.palette.GRAY_PEN_100)
+        gc.StrokeLine(0, self.pany, w, self.pany)
+        gc.StrokeLine(self.panx, 0, self.panx, h)
+        
+    def gridPaths(self, gc, w, h):
+        # minor and major grid lines as two paths, reused until the window size or
+        # zoom changes or the view is panned by something other than whole major cells
+        minor = self.gridsize*self.zoom
+        while minor*self.major_every < self.min_grid_spacing:
+            minor *= self.major_every
+        major = minor*self.major_every
+        key = (w, h, minor, self.panx%major, self.pany%major)
+        if key != self.grid_key:
+            self.grid_key = key
+            self.grid_paths = (self.buildGridPath(gc, w, h, minor, key[3], key[4], False)
+                               if minor >= self.min_grid_spacing else None,
+                               self.buildGridPath(gc, w, h, minor, key[3], key[4], True))
+        return self.grid_paths
+        
+    def buildGridPath(self, gc, w, h, step, x0, y0, major):
+        # x0, y0 is the first major line, every major_every-th line from there is major
+        path = gc.CreatePath()
+        Drawable.paths_created += 1
+        for origin, size, length, vertical in ((x0, w, h, True), (y0, h, w, False)):
+            n = -int(origin//step)
+            while origin+n*step < size-1:
+                if (n%self.major_every == 0) == major:
+                    pos = origin+n*step
+                    if vertical:
+                        path.MoveToPoint(pos, 0)
+                        path.AddLineToPoint(pos, length)
+                    else:
+                        path.MoveToPoint(0, pos)
+                        path.AddLineToPoint(length, pos)
+                n += 1
+        return path
+        
+    def drawImage(self, gc, w, h):
+        gc.Translate(self.panx, self.pany)
+        gc.Scale(self.zoom, self.zoom)
+        x, y = self.toWorld(0, 0)
+        self.bgImage.draw(gc, self.zoom, (x, y, w/self.zoom, h/self.zoom))
+        
+    def afterFirstPaint(self):
+        if not self:
+            return
+        self.loadReference('facemap.jpg', -self.panx, -self.pany)
+        
+    def loadReference(self, file, x, y):
+        # the window stays responsive, a placeholder is shown until the image is decoded
+        self.setReference(self.image_loader.load(file, x, y, self.referenceLoaded))
+        
+    def referenceLoaded(self, placeholder, image):
+        # the viewport may be gone, or another reference chosen in the meantime
+        if not self or self.bgImage is not placeholder:
+            return
+        self.setReference(image)
+        
+    def setReference(self, image):
+        if self.bgImage is not None:
+            self.damageElement(self.bgImage)
+        if self.hovered_element is self.bgImage:
+            self.hovered_element = None
+        self.bgImage = image
+        self.image_layer.invalidate()
+        if image is not None:
+            self.damageElement(image)
+        self.flushDamage()
+        
+    def unsettleImage(self):
+        if not self.bgImage:
+            return
+        self.bgImage.settled = False
+        if self.image_settle is None:
+            self.image_settle = wx.CallLater(self.image_settle_delay, self.settleImage)
+        else:
+            self.image_settle.Start(self.image_settle_delay)
+            
+    def settleImage(self):
+        if not self or not self.bgImage:
+            return
+        self.bgImage.settled = True
+        self.damageElement(self.bgImage)
+        self.flushDamage()
+        
+    def OnDestroy(self, event):
+        if event.GetEventObject() is self:
+            self.group.viewports.remove(self)
+            # loads still queued are dropped, running ones finish in the background
+            self.image_loader.shutdown()
+            if self.recorder:
+                self.recorder.close()
+        event.Skip()
         
     def OnSize(self, e):
+        self.background_layer.invalidate()
+        self.image_layer.invalidate()
         self.Refresh()
 
     def OnMouseMotion(self, event):
+        self.profiler.event()
+        if self.recorder:
+            self.recorder.record(event)
         x, y = event.GetPosition()
         #print(x-self.panx, y-self.pany)
-        dx, dy = x-self.lastx, y-self.lasty
+        if not event.Dragging():
+            mode = 'hover'
+        elif event.MiddleIsDown():
+            mode = 'pan'
+        elif event.LeftIsDown():
+            mode = 'drag'
+        else:
+            mode = None
+        # deltas only add up within one kind of motion
+        if mode != self.motion_mode:
+            self.scheduler.flush()
+            self.motion_mode = mode
+            
+        self.motion_dx += x-self.lastx
+        self.motion_dy += y-self.lasty
         self.lastx, self.lasty = x, y
-        
-        if event.Dragging():
-            if event.MiddleIsDown():
-                self.panx += dx
-                self.pany += dy
-            elif event.LeftIsDown():
-                if self.hovered_element:
-                    # move shape handles
-                    self.hovered_element.move(dx, dy, event)
-        else: # event.Dragging
-            self.hovered_element = None
-            found = False
-            for shape in self.shapes:
-                for handle in shape.getHandles():
-                    if handle.contains(x-self.panx, y-self.pany):
-                        self.hovered_element = handle
-                        found = True
-                        break
-                if found:
-                    break
-            if not found and self.bgImage:
-                if self.bgImage.contains(x-self.panx, y-self.pany, event):
-                    self.hovered_element = self.bgImage
+        self.motion_state.SetState(event)
+        
+        self.scheduler.request()
+        
+    def applyMotion(self):
+        x, y = self.lastx, self.lasty
+        dx, dy = self.motion_dx, self.motion_dy
+        self.motion_dx = self.motion_dy = 0
+        event = self.motion_state
+        
+        if self.motion_mode == 'hover':
+            with self.profiler.section('hover'):
+                hovered = self.hitTest(*self.toWorld(x, y), event)
+            if hovered is not self.hovered_element:
+                # only the handle highlight changes
+                for element in (self.hovered_element, hovered):
+                    if isinstance(element, Handle):
+                        self.damage(element.getBounds())
+                self.hovered_element = hovered
+        elif self.motion_mode == 'pan':
+            self.panx += dx
+            self.pany += dy
+            self.damageAll()
+        elif self.motion_mode == 'drag':
+            if self.hovered_element:
+                # move shape handles
+                self.damageElement(self.hovered_element)
+                self.history.touch(self.hovered_element)
+                self.hovered_element.move(dx/self.zoom, dy/self.zoom, event)
+                self.damageElement(self.hovered_element)
                     
-        self.Refresh()
+        self.flushDamage()
     
+    def OnLeftUp(self, event):
+        if self.recorder:
+            self.recorder.record(event)
+        # the drag ends here, motion still waiting for a frame belongs to it
+        self.scheduler.flush()
+        self.history.end()
+        event.Skip()
+        
+    def endGestureLater(self):
+        if self.gesture_end is None:
+            self.gesture_end = wx.CallLater(self.gesture_delay, self.endGesture)
+        else:
+            self.gesture_end.Start(self.gesture_delay)
+            
+    def endGesture(self):
+        # a wheel run during a drag is part of the drag
+        if self and not wx.GetMouseState().LeftIsDown():
+            self.history.end()
+            
+    def undo(self, redo = False):
+        changed = self.history.redo() if redo else self.history.undo()
+        if changed:
+            self.damageModelAll()
+            self.flushDamage()
+            
     def OnMouseWheel(self, event):
-        if self.hovered_element:
+        self.profiler.event()
+        if self.recorder:
+            self.recorder.record(event)
+        self.scheduler.flush()
+        element = self.hovered_element
+        if isinstance(element, Handle):
+            # handles have no size, and the view only zooms with no handle hovered
+            return
+        if element and event.ControlDown():
             s = event.GetLinesPerAction()* event.GetWheelRotation()/120
-            self.hovered_element.scale(s, event)
+            self.damageElement(element)
+            self.history.touch(element)
+            element.scale(s, event)
+            self.damageElement(element)
+            self.endGestureLater()
+            if element is self.bgImage:
+                self.unsettleImage()
+        else:
+            x, y = event.GetPosition()
+            self.zoomAt(x, y, 1.1**(event.GetWheelRotation()/event.GetWheelDelta()))
+            self.unsettleImage()
         
-        self.Refresh()
+        self.flushDamage()
     
 class MainFrame(wx.Frame):
-    def __init__(self, *args, **kw):
+    def __init__(self, *args, library = None, character = 0, autosave_path = 'facemap-autosave', **kw):
         super().__init__(*args, **kw)
 
         self.shapes = []
+        self.handles = HandleTable()
         # create default shapes
-        #shape = Head('Head')
-        shape = Proportion('Male')
+        #shape = Head('Head', self.handles)
+        shape = Proportion('Male', self.handles)
         
         self.shapes.append(shape)
         
-        self.viewport = Viewport(self, self.shapes)
+        # all viewports show the same shapes, Ctrl+N opens another one
+        self.views = ViewGroup(self.shapes)
+        self.sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.SetSizer(self.sizer)
+        self.viewport = self.addViewport()
+        
+        # edits are journaled in the background to survive a crash, unless
+        # autosave_path is None (benchmarks)
+        self.autosave = autosave.Autosave(autosave_path) if autosave_path else None
+        
+        # the open library stays mapped, characters are read from it when opened
+        self.library = None
+        self.character = 0
+        self.save_file = 'facemap.fms'
+        if library:
+            self.openLibrary(library, character)
+        else:
+            self.restore()
+            
+        save_id, view_id = wx.NewIdRef(), wx.NewIdRef()
+        self.Bind(wx.EVT_MENU, self.OnSave, id=save_id)
+        self.Bind(wx.EVT_MENU, lambda event: self.addViewport(), id=view_id)
+        self.SetAcceleratorTable(wx.AcceleratorTable([(wx.ACCEL_CTRL, ord('S'), save_id),
+                                                      (wx.ACCEL_CTRL, ord('N'), view_id)]))
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+        
+    def addViewport(self):
+        # e.g. a side or 3/4 view next to the front view
+        viewport = Viewport(self, self.shapes, group=self.views)
+        self.sizer.Add(viewport, 1, wx.EXPAND)
+        self.Layout()
+        return viewport
+        
+    def openLibrary(self, file, character = 0):
+        if self.library:
+            self.library.close()
+        self.library = scene.Library(file)
+        self.save_file = file
+        self.openCharacter(character)
+        
+    def openCharacter(self, index):
+        self.handles = HandleTable()
+        self.viewport.setShapes(self.library.load(index, SHAPE_TYPES, self.handles))
+        self.character = index
+        self.SetTitle('Facemap - %s' % self.library.name(index))
+        if self.autosave:
+            self.autosave.track(self.shapes)
+        
+    def restore(self):
+        # pick up where the last session (or crash) left off
+        if not self.autosave:
+            return
+        table = HandleTable()
+        try:
+            shapes = self.autosave.recover(SHAPE_TYPES, table)
+        except (OSError, ValueError) as error:
+            # a damaged snapshot must not stop the program from starting
+            wx.LogError('Could not restore the autosave: %s' % error)
+            shapes = None
+        if shapes:
+            self.handles = table
+            self.viewport.setShapes(shapes)
+        self.autosave.track(self.shapes)
+        
+    def saveCharacter(self, file):
+        if self.library and os.path.abspath(file) == os.path.abspath(self.library.file.name):
+            # only the open character changes, the rest of the library is copied
+            self.library = scene.replaceCharacter(self.library, self.character, self.shapes)
+            return
+        if os.path.exists(file):
+            library = scene.Library(file)
+            count = len(library)
+            library.close()
+            if count > 1:
+                raise ValueError('%s holds %d characters and is not open' % (file, count))
+        # written as a library of one character, so it opens like any other
+        name = self.shapes[0].name if self.shapes else 'Untitled'
+        scene.saveLibrary(file, [(name, self.shapes)])
+        
+    def OnSave(self, event):
+        try:
+            self.saveCharacter(self.save_file)
+        except (OSError, ValueError) as error:
+            wx.LogError('Could not save %s: %s' % (self.save_file, error))
+        
+    def OnClose(self, event):
+        if self.library:
+            self.library.close()
+        if self.autosave:
+            self.autosave.close()
+        event.Skip()
 
     def OnExit(self, event):
         self.Close(True)
 
 if __name__ == '__main__':
+    # python facemap.py [library.fms [character index]]
     app = wx.App()
-    frm = MainFrame(None, title='Facemap')
+    frm = MainFrame(None, title='Facemap', library=sys.argv[1] if len(sys.argv) > 1 else None,
+                    character=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
     frm.Show()
     app.MainLoop()
     
\ No newline at end of file
@@ -0,0 +1,73 @@
+'''
+2D affine transforms applied to whole batches of control points.
+
+Transforms compose with @ (a @ b applies b first), so a chain like the
+Scale/Translate/Rotate calls on a GraphicsContext becomes one matrix that is
+applied to all points at once. NumPy is used for large batches when it is
+installed.
+'''
+
+import math
+
+# imported on the first large batch, so importing this module stays cheap;
+# False once the import has failed
+numpy = None
+
+def loadNumpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy
+
+# below this many points converting to an array costs more than it saves
+NUMPY_MIN_POINTS = 64
+
+class Affine:
+    # x' = a*x + c*y + e
+    # y' = b*x + d*y + f
+    __slots__ = ('a', 'b', 'c', 'd', 'e', 'f')
+
+    def __init__(self, a = 1, b = 0, c = 0, d = 1, e = 0, f = 0):
+        self.a, self.b, self.c, self.d, self.e, self.f = a, b, c, d, e, f
+
+    @classmethod
+    def translation(cls, tx, ty):
+        return cls(1, 0, 0, 1, tx, ty)
+
+    @classmethod
+    def scaling(cls, sx, sy = None):
+        return cls(sx, 0, 0, sx if sy is None else sy, 0, 0)
+
+    @classmethod
+    def rotation(cls, angle, cx = 0, cy = 0):
+        # angle in degrees around (cx, cy), same direction as GraphicsContext.Rotate
+        r = math.radians(angle)
+        cos, sin = math.cos(r), math.sin(r)
+        return cls(cos, sin, -sin, cos, cx - cos*cx + sin*cy, cy - sin*cx - cos*cy)
+
+    def __matmul__(self, other):
+        return Affine(self.a*other.a + self.c*other.b,
+                      self.b*other.a + self.d*other.b,
+                      self.a*other.c + self.c*other.d,
+                      self.b*other.c + self.d*other.d,
+                      self.a*other.e + self.c*other.f + self.e,
+                      self.b*other.e + self.d*other.f + self.f)
+
+    def apply(self, x, y):
+        return self.a*x + self.c*y + self.e, self.b*x + self.d*y + self.f
+
+    def transform(self, points):
+        # a list of (x, y) tuples, whichever way it is computed
+        a, b, c, d, e, f = self.a, self.b, self.c, self.d, self.e, self.f
+        if len(points) >= NUMPY_MIN_POINTS and loadNumpy():
+            result = numpy.asarray(points, dtype=float) @ numpy.array([[a, b], [c, d]]) + (e, f)
+            return list(map(tuple, result.tolist()))
+        return [(a*x + c*y + e, b*x + d*y + f) for x, y in points]
+
+def overlaps(a, b):
+    # (x, y, w, h) rectangles
+    return a[0] < b[0]+b[2] and b[0] < a[0]+a[2] and a[1] < b[1]+b[3] and b[1] < a[1]+a[3]
@@ -0,0 +1,92 @@
+'''
+Undo and redo for edits to UI elements.
+
+Elements touched during a gesture (a drag, a run of wheel ticks) are
+remembered with their state from before the first change. When the gesture
+ends one entry is stored with the states before and after, packed into
+arrays of doubles, so a long drag costs one entry however many motion events
+it had. The oldest entries are dropped once the history is over its memory
+budget.
+'''
+
+import collections
+from array import array
+
+# rough size of an entry besides its values, used for the memory budget
+ENTRY_OVERHEAD = 200
+
+class History:
+    def __init__(self, max_bytes = 1024*1024):
+        self.max_bytes = max_bytes
+        self.undo_entries = collections.deque()
+        self.redo_entries = []
+        self.size = 0
+        # id(element) -> element and its state before the current gesture changed it
+        self.gesture = {}
+
+    def touch(self, element):
+        # call before changing element, only the first call in a gesture counts
+        if id(element) not in self.gesture:
+            state = element.getState()
+            if state is not None:
+                self.gesture[id(element)] = element, state
+
+    def end(self):
+        # stores the current gesture, returns False if nothing changed
+        gesture, self.gesture = self.gesture, {}
+        elements, widths, before, after = [], array('B'), array('d'), array('d')
+        for element, old in gesture.values():
+            new = element.getState()
+            if new != old:
+                elements.append(element)
+                widths.append(len(old))
+                before.extend(old)
+                after.extend(new)
+        if not elements:
+            return False
+        for entry in self.redo_entries:
+            self.size -= self.entrySize(entry)
+        self.redo_entries.clear()
+        self.push(self.undo_entries, (tuple(elements), widths, before, after))
+        return True
+
+    def entrySize(self, entry):
+        elements, widths, before, after = entry
+        return ENTRY_OVERHEAD+8*len(elements)+len(widths)+before.itemsize*(len(before)+len(after))
+
+    def push(self, entries, entry):
+        entries.append(entry)
+        self.size += self.entrySize(entry)
+        while self.size > self.max_bytes and self.undo_entries:
+            self.size -= self.entrySize(self.undo_entries.popleft())
+
+    def apply(self, entry, values):
+        elements, widths = entry[0], entry[1]
+        pos = 0
+        for element, width in zip(elements, widths):
+            element.setState(tuple(values[pos:pos+width]))
+            pos += width
+        return elements
+
+    def undo(self):
+        # returns the elements that changed
+        self.end()
+        if not self.undo_entries:
+            return ()
+        entry = self.undo_entries.pop()
+        self.redo_entries.append(entry)
+        return self.apply(entry, entry[2])
+
+    def redo(self):
+        self.end()
+        if not self.redo_entries:
+            return ()
+        entry = self.redo_entries.pop()
+        self.undo_entries.append(entry)
+        return self.apply(entry, entry[3])
+
+    def clear(self):
+        self.undo_entries.clear()
+        self.redo_entries.clear()
+        self.size = 0
+        self.gesture = {}
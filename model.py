@@ -0,0 +1,344 @@
+'''
+Shapes and their handles, without any drawing.
+
+Importing this module does not import wx, so tools that only load, edit or
+check shapes run without a display. facemap.py draws these shapes.
+'''
+
+from array import array
+
+from geometry import Affine
+
+def rotate(px, py, angle, cx=0, cy=0):
+    return Affine.rotation(angle, cx, cy).apply(px, py)
+    
+class UIElement:
+    __slots__ = ()
+    
+    def move(self, dx = 0, dy = 0, event=None):
+        pass
+    
+    def draw(self, gc):
+        pass
+        
+    def contains(self, x, y):
+        return False
+        
+    def scale(self, s=1, event=None):
+        pass
+        
+    def getBounds(self):
+        return None
+        
+    def getState(self):
+        # tuple of numbers that setState restores, None if the element has no undo
+        return None
+        
+    def setState(self, state):
+        pass
+        
+class HandleTable:
+    # positions, constraint flags and bounds of many handles in contiguous arrays
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+        self.canx = array('b')
+        self.cany = array('b')
+        self.minx = array('d')
+        self.maxx = array('d')
+        self.miny = array('d')
+        self.maxy = array('d')
+        
+    def __len__(self):
+        return len(self.x)
+        
+    def add(self, x, y):
+        self.x.append(x)
+        self.y.append(y)
+        self.canx.append(1)
+        self.cany.append(1)
+        self.minx.append(-1000)
+        self.maxx.append(1000)
+        self.miny.append(-1000)
+        self.maxy.append(1000)
+        return len(self.x)-1
+        
+
+def tableField(name):
+    def get(self):
+        return getattr(self.table, name)[self.index]
+    def set(self, value):
+        getattr(self.table, name)[self.index] = value
+    return property(get, set)
+    
+def clampMove(value, delta, low, high):
+    # moves value by delta but not past the limits; a value already outside them
+    # (set by undo or a library) is never pulled back against the motion
+    if delta > 0:
+        return min(value+delta, max(high, value))
+    return max(value+delta, min(low, value))
+    
+class Handle(UIElement):
+    # a view on one row of a HandleTable
+    __slots__ = ('name', 'table', 'index', 'shape', 'observers')
+    
+    x = tableField('x')
+    y = tableField('y')
+    canx = tableField('canx')
+    cany = tableField('cany')
+    minx = tableField('minx')
+    maxx = tableField('maxx')
+    miny = tableField('miny')
+    maxy = tableField('maxy')
+    
+    def __init__(self, name, x, y, table = None):
+        self.name = name
+        # a handle without a table gets one of its own, freed with it
+        self.table = HandleTable() if table is None else table
+        self.index = self.table.add(x, y)
+        
+        self.shape = None
+        self.observers = []
+    
+    def addObserver(self, observer):
+        self.observers.append(observer)
+        
+    def removeObserver(self, observer):
+        self.observers.remove(observer)
+        
+    def notifyMoved(self):
+        for observer in self.observers:
+            observer.handleMoved(self)
+    
+    def setConstraints(self, canx = True, minx = -1000, maxx =  1000, cany = True, miny = -1000, maxy =  1000):
+        t, i = self.table, self.index
+        t.canx[i] = canx
+        t.minx[i] = minx
+        t.maxx[i] = maxx
+        t.cany[i] = cany
+        t.miny[i] = miny
+        t.maxy[i] = maxy
+    
+    def canMoveX(self, delta = 0):
+        t, i = self.table, self.index
+        x = t.x[i]+delta
+        return bool(t.canx[i]) and t.minx[i] <= x <= t.maxx[i]
+            
+    def canMoveY(self, delta = 0):
+        t, i = self.table, self.index
+        y = t.y[i]+delta
+        return bool(t.cany[i]) and t.miny[i] <= y <= t.maxy[i]
+    
+    def moveX(self, delta = 0):
+        t, i = self.table, self.index
+        if delta and t.canx[i]:
+            x = clampMove(t.x[i], delta, t.minx[i], t.maxx[i])
+            if x != t.x[i]:
+                t.x[i] = x
+                self.notifyMoved()
+            
+    def moveY(self, delta = 0):
+        t, i = self.table, self.index
+        if delta and t.cany[i]:
+            y = clampMove(t.y[i], delta, t.miny[i], t.maxy[i])
+            if y != t.y[i]:
+                t.y[i] = y
+                self.notifyMoved()
+            
+    def move(self, dx = 0, dy = 0, event=None):
+        self.moveX(dx)
+        self.moveY(dy)
+        
+    def moveTo(self, x, y):
+        self.move(x-self.x, y-self.y)
+        
+    def getState(self):
+        return self.x, self.y
+        
+    def setState(self, state):
+        # restores an earlier position without applying the constraints again
+        self.x, self.y = state
+        self.notifyMoved()
+        
+    def contains(self, x, y):
+        t, i = self.table, self.index
+        hx, hy = t.x[i], t.y[i]
+        return hx-5 <= x < hx+5 and hy-5 <= y < hy+5
+        
+    def getBounds(self):
+        return self.x-5, self.y-5, 10, 10
+        
+    def draw(self, gc):
+        gc.DrawRoundedRectangle(self.x-5, self.y-5, 10, 10, 3)
+        
+class HandleGrid:
+    # uniform grid over handle rectangles, kept up to date by observing the handles
+    def __init__(self, cellsize = 50):
+        self.cellsize = cellsize
+        self.cells = {}
+        self.keys = {}
+        self.order = {}
+        self.counter = 0
+        
+    def cellKeys(self, handle):
+        x, y = handle.x, handle.y
+        c = self.cellsize
+        return [(cx, cy) for cx in range(int((x-5)//c), int((x+5)//c)+1)
+                         for cy in range(int((y-5)//c), int((y+5)//c)+1)]
+        
+    def insert(self, handle):
+        if handle in self.order:
+            return
+        # hits are resolved in insertion order, same as walking the shapes
+        self.order[handle] = self.counter
+        self.counter += 1
+        self.place(handle)
+        handle.addObserver(self)
+        
+    def remove(self, handle):
+        if handle not in self.order:
+            return
+        handle.removeObserver(self)
+        self.unplace(handle)
+        del self.order[handle]
+        
+    def place(self, handle):
+        keys = self.cellKeys(handle)
+        self.keys[handle] = keys
+        for key in keys:
+            self.cells.setdefault(key, []).append(handle)
+            
+    def unplace(self, handle):
+        for key in self.keys.pop(handle, ()):
+            cell = self.cells[key]
+            cell.remove(handle)
+            if not cell:
+                del self.cells[key]
+                
+    def handleMoved(self, handle):
+        if self.cellKeys(handle) != self.keys.get(handle):
+            self.unplace(handle)
+            self.place(handle)
+            
+    def query(self, x, y):
+        c = self.cellsize
+        found = None
+        for handle in self.cells.get((int(x//c), int(y//c)), ()):
+            if handle.contains(x, y) and (found is None or self.order[handle] < self.order[found]):
+                found = handle
+        return found
+        
+class Shape:
+    # attributes set through configure that are saved with the shape
+    attrs = ()
+    
+    def __init__(self, name, table = None):
+        self.name = name
+        # the handles of a shape without a table share one that is freed with the shape
+        self.table = HandleTable() if table is None else table
+        self.handles = {}
+        # cached result of computeBounds
+        self.bounds = None
+        
+    def addHandle(self, handle):
+        self.handles[handle.name] = handle
+        handle.shape = self
+        handle.addObserver(self)
+        
+    def handleMoved(self, handle):
+        self.bounds = None
+        
+    def getHandles(self):
+        return self.handles.values()
+        
+    def setHandles(self, positions):
+        for name, (x, y) in positions.items():
+            self.handles[name].moveTo(x, y)
+            
+    def configure(self, **attrs):
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        self.bounds = None
+            
+    def getBounds(self):
+        if self.bounds is None:
+            self.bounds = self.computeBounds()
+        return self.bounds
+        
+    def computeBounds(self):
+        return None
+        
+class Proportion(Shape):
+    attrs = ('size', 'num_heads')
+    
+    def __init__(self, name, table = None):
+        super().__init__(name, table)
+        
+        self.size = 20
+        self.num_heads = 8
+        self.updateProportions()
+        
+    def updateProportions(self):
+        self.start_y = -int(self.size*self.num_heads/2)
+        self.shoulder_y = self.start_y + self.size + self.size/2
+        
+    def configure(self, **attrs):
+        super().configure(**attrs)
+        self.updateProportions()
+        
+    def computeBounds(self):
+        half = max(100, 3*self.size)
+        bottom = max(-self.start_y, self.num_heads/2*self.size) + self.size/4
+        return -half, self.start_y, 2*half, bottom-self.start_y
+        
+    def armTransform(self):
+        # the right arm hangs 25 degrees out from the shoulder
+        shoulder_x = 2*self.size/3
+        return Affine.rotation(-25, shoulder_x, self.shoulder_y)
+        
+class Head(Shape):
+    def __init__(self, name, table = None):
+        super().__init__(name, table)
+        
+        self.head_handle = Handle('Head Width', 50, 0, self.table)
+        self.head_handle.setConstraints(cany=False, minx=10)
+        self.addHandle(self.head_handle)
+        
+        self.jaw_handle = Handle('Jaw', 40, 70, self.table)
+        self.addHandle(self.jaw_handle)
+        
+        self.chin_width_handle = Handle('Chin Width', 20, 90, self.table)
+        self.addHandle(self.chin_width_handle)
+        
+        self.chin_handle = Handle('Chin', 0, 95, self.table)
+        self.addHandle(self.chin_handle)
+        
+        self.eyes_handle = Handle('Eyes', 22, 23, self.table)
+        self.addHandle(self.eyes_handle)
+        
+        self.nose_handle = Handle('Nose', 0, 55, self.table)
+        self.nose_handle.setConstraints(canx=False)
+        self.addHandle(self.nose_handle)
+        
+        self.mouth_handle = Handle('Mouth', 0, 66, self.table)
+        self.mouth_handle.setConstraints(canx=False)
+        self.addHandle(self.mouth_handle)
+        
+        self.hairline_handle = Handle('Hairline', 0, -30, self.table)
+        self.hairline_handle.setConstraints(canx=False)
+        self.addHandle(self.hairline_handle)
+        
+    def computeBounds(self):
+        # every point the outline, features, hair and block-in drawing can reach;
+        # handles can be set outside their constraints (undo, libraries), hence abs()
+        head_r = abs(self.head_handle.x)
+        eyes_x, eyes_y = abs(self.eyes_handle.x), self.eyes_handle.y
+        nose_y, mouth_y, hair_y = self.nose_handle.y, self.mouth_handle.y, self.hairline_handle.y
+        half = max(head_r+8, abs(self.jaw_handle.x), abs(self.chin_width_handle.x), eyes_x+18, 45)
+        ys = [-head_r-8, self.jaw_handle.y, self.chin_width_handle.y, self.chin_handle.y, -40, 14,
+              eyes_y-14, eyes_y+20, nose_y-10, nose_y, mouth_y-16, mouth_y+7, hair_y-5, hair_y+45]
+        if self.head_handle.x < 0:
+            # a negative radius turns the skull and hair arcs downwards
+            ys.append(head_r+8)
+        top, bottom = min(ys), max(ys)
+        return -half, top, 2*half, bottom-top
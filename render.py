@@ -0,0 +1,95 @@
+'''
+Render shapes to PNG files without opening a window.
+
+Usage:
+    python render.py scenes.json -o out --size 400x400
+
+scenes.json holds a list of scenes. A scene is one shape or a list of shapes:
+    {"type": "Proportion", "attrs": {"num_heads": 7.5}}
+    {"type": "Head", "handles": {"Jaw": [45, 70], "Eyes": [25, 23]}, "file": "wide-jaw.png"}
+Scenes without a "file" are written as 00000.png, 00001.png, ...
+'''
+
+import argparse
+import json
+import os
+import wx
+
+from facemap import SHAPE_TYPES, Palette
+from model import HandleTable
+
+def createShape(spec, table = None):
+    shape = SHAPE_TYPES[spec['type']](spec.get('name', spec['type']), table)
+    shape.configure(**spec.get('attrs', {}))
+    shape.setHandles(spec.get('handles', {}))
+    return shape
+
+def createScene(scene):
+    if isinstance(scene, dict):
+        scene = [scene]
+    # each scene gets its own handle table, freed with the scene
+    table = HandleTable()
+    return [createShape(spec, table) for spec in scene]
+
+def sceneFile(scene, index):
+    if isinstance(scene, dict):
+        scene = [scene]
+    for spec in scene:
+        if 'file' in spec:
+            return spec['file']
+    return '%05d.png' % index
+
+def parseSize(size):
+    w, h = size.lower().split('x')
+    return int(w), int(h)
+
+class Renderer:
+    # the bitmap, dc and palette are reused for every image
+    def __init__(self, width, height, shaded = True, background = wx.Colour(255,255,255)):
+        self.width, self.height = width, height
+        self.shaded = shaded
+        self.palette = Palette()
+        self.background = wx.Brush(background)
+        self.bitmap = wx.Bitmap(width, height)
+        self.dc = wx.MemoryDC()
+
+    def render(self, shapes):
+        self.dc.SelectObject(self.bitmap)
+        gc = wx.GraphicsContext.Create(self.dc)
+
+        gc.SetBrush(self.background)
+        gc.DrawRectangle(0, 0, self.width, self.height)
+
+        # shapes are drawn around the center of the image
+        gc.Translate(self.width/2, self.height/2)
+        for shape in shapes:
+            shape.draw(self.palette, gc, self.shaded)
+
+        # drawing is only flushed to the bitmap once the context is gone
+        del gc
+        self.dc.SelectObject(wx.NullBitmap)
+        return self.bitmap
+
+    def save(self, shapes, file):
+        return self.render(shapes).SaveFile(file, wx.BITMAP_TYPE_PNG)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Render facemap scenes to PNG files.')
+    parser.add_argument('scenes', help='JSON file with a list of scenes')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    parser.add_argument('--size', default='400x400', help='image size as WIDTHxHEIGHT')
+    parser.add_argument('--unshaded', action='store_true', help='draw outlines only')
+    args = parser.parse_args(argv)
+
+    with open(args.scenes) as f:
+        scenes = json.load(f)
+    width, height = parseSize(args.size)
+
+    app = wx.App(False)
+    renderer = Renderer(width, height, not args.unshaded)
+    os.makedirs(args.output, exist_ok=True)
+    for i, scene in enumerate(scenes):
+        renderer.save(createScene(scene), os.path.join(args.output, sceneFile(scene, i)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+Play back input recorded in the viewport (F5) and report how fast it was handled.
+
+Usage:
+    python replay.py facemap-session.jsonl [-o report.json] [--realtime]
+
+The session file starts with the window size, view and shapes the recording
+began with, so a replay always starts from the same scene. Events are fed
+straight to a Viewport as fast as possible, each one applied and painted
+before the next, or with --realtime at the recorded pace, where motion is
+coalesced by the frame scheduler as it was live. The report holds per-event
+latency, the number of paints, the final view and the final handle positions,
+as JSON. Like bench.py, a private Xvfb server is started when there is no
+display.
+'''
+
+import argparse
+import json
+import os
+import time
+
+from bench import ensureDisplay
+
+def readSession(file):
+    with open(file) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    if header.get('version') != 2:
+        raise ValueError('%s is not a session this version can replay' % file)
+    return header, events
+
+def createEvent(record):
+    import wx
+    kind = record['type']
+    if kind == 'key':
+        event = wx.KeyEvent(wx.wxEVT_KEY_DOWN)
+        # wxPython has no m_keyCode and friends, only the setters reach the C++ event
+        event.SetKeyCode(record['key'])
+    else:
+        event = wx.MouseEvent({'motion': wx.wxEVT_MOTION, 'wheel': wx.wxEVT_MOUSEWHEEL,
+                               'left_up': wx.wxEVT_LEFT_UP}[kind])
+        event.SetX(record['x'])
+        event.SetY(record['y'])
+        down = record['down']
+        event.SetLeftDown('L' in down)
+        event.SetMiddleDown('M' in down)
+        event.SetRightDown('R' in down)
+        if kind == 'wheel':
+            event.SetWheelRotation(record['rotation'])
+            event.SetWheelDelta(record['delta'])
+            event.SetLinesPerAction(record['lines'])
+    mods = record['mods']
+    event.SetControlDown('C' in mods)
+    event.SetShiftDown('S' in mods)
+    event.SetAltDown('A' in mods)
+    return event
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values)-1, int(p*len(values)))]*1000, 3)
+    return {'count': len(values), 'p50_ms': pick(.5), 'p95_ms': pick(.95), 'p99_ms': pick(.99),
+            'max_ms': round(values[-1]*1000, 3)}
+
+def replay(header, events, realtime = False, timeout = 10):
+    import wx
+    from facemap import HandleTable, PlaceholderImage, Viewport, shapeSpec, specShape
+
+    frame = wx.Frame(None, title='Facemap replay')
+    table = HandleTable()
+    viewport = Viewport(frame, [specShape(spec, table) for spec in header['shapes']])
+    frame.SetClientSize(*header['size'])
+    viewport.panx, viewport.pany, viewport.zoom = header['panx'], header['pany'], header['zoom']
+    viewport.shaded = header['shaded']
+    viewport.background_image = header['background_image']
+    viewport.gridsize = header['gridsize']
+    viewport.lastx, viewport.lasty = header['mouse']
+    frame.Show()
+    # start from a painted window with the reference image loaded, as the user saw it
+    deadline = time.perf_counter()+timeout
+    while (viewport.first_paint is None or isinstance(viewport.bgImage, PlaceholderImage)) \
+            and time.perf_counter() < deadline:
+        wx.Yield()
+    if header['image'] and viewport.bgImage:
+        # where the user had moved and scaled the reference image to
+        viewport.bgImage.setState(tuple(header['image']))
+    viewport.damageAll()
+    viewport.flushDamage()
+    viewport.Update()
+
+    handler = viewport.GetEventHandler()
+    latencies = {}
+    paints = viewport.paint_count
+    start = time.perf_counter()
+    for record in events:
+        if realtime:
+            # timers (frame scheduler, wheel gestures) run while waiting for the next event
+            while time.perf_counter()-start < record['t']:
+                wx.Yield()
+        event = createEvent(record)
+        begin = time.perf_counter()
+        handler.ProcessEvent(event)
+        if not realtime:
+            viewport.scheduler.flush()
+        viewport.Update()
+        latencies.setdefault(record['type'], []).append(time.perf_counter()-begin)
+    viewport.scheduler.flush()
+    viewport.Update()
+    elapsed = time.perf_counter()-start
+
+    result = {
+        'events': len(events),
+        'seconds': round(elapsed, 3),
+        'paints': viewport.paint_count-paints,
+        'latency': {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+        'view': {'panx': viewport.panx, 'pany': viewport.pany, 'zoom': viewport.zoom,
+                 'shaded': viewport.shaded, 'background_image': viewport.background_image},
+        'shapes': [shapeSpec(shape) for shape in viewport.shapes],
+    }
+    frame.Destroy()
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Replay a recorded facemap session.')
+    parser.add_argument('session', help='JSON lines file written by the viewport (F5)')
+    parser.add_argument('-o', '--output', help='write the JSON report to this file')
+    parser.add_argument('--realtime', action='store_true', help='keep the recorded pace between events')
+    args = parser.parse_args(argv)
+
+    header, events = readSession(args.session)
+    session = os.path.abspath(args.session)
+    output = args.output and os.path.abspath(args.output)
+    # facemap loads its reference image relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    server = ensureDisplay()
+    try:
+        import wx
+        app = wx.App(False)
+        result = replay(header, events, args.realtime)
+    finally:
+        if server:
+            server.terminate()
+    result['session'] = session
+
+    text = json.dumps(result, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text+'\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+'''
+Binary scene libraries.
+
+A library holds many characters, a character is a list of shapes. Every part
+is a fixed-size record, so the file is memory-mapped and only the characters
+that are opened are read:
+
+    header      magic, format version, number of characters
+    index       per character: offset of its first shape, number of shapes, name
+    shapes      per shape: type, name, number of handles, attributes,
+                followed by one record per handle (position and constraints)
+
+Shapes are created from their type name through a mapping, so the GUI can load
+its drawable shapes and other tools the plain model ones.
+'''
+
+import mmap
+import os
+import struct
+
+import atomic
+import model
+
+MAGIC = b'FMSC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+INDEX = struct.Struct('<QI4x32s')
+SHAPE = struct.Struct('<16s32sI4d')
+HANDLE = struct.Struct('<24s2d2B6x4d')
+# attribute slots in a shape record
+MAX_ATTRS = 4
+
+MODEL_TYPES = {
+    'Head': model.Head,
+    'Proportion': model.Proportion,
+}
+
+def encode(text, size):
+    data = text.encode('utf-8')
+    if len(data) > size:
+        raise ValueError('%r is longer than %d bytes' % (text, size))
+    return data
+
+def decode(data):
+    return data.rstrip(b'\0').decode('utf-8')
+
+def packCharacter(shapes):
+    # the shape and handle records of one character
+    records = []
+    for shape in shapes:
+        if len(shape.attrs) > MAX_ATTRS:
+            raise ValueError('%s has more than %d attributes' % (type(shape).__name__, MAX_ATTRS))
+        attrs = [getattr(shape, attr) for attr in shape.attrs]
+        attrs += [0]*(MAX_ATTRS-len(attrs))
+        records.append(SHAPE.pack(encode(type(shape).__name__, 16), encode(shape.name, 32),
+                                  len(shape.handles), *attrs))
+        for handle in shape.getHandles():
+            records.append(HANDLE.pack(encode(handle.name, 24), handle.x, handle.y, handle.canx, handle.cany,
+                                       handle.minx, handle.maxx, handle.miny, handle.maxy))
+    return b''.join(records)
+
+def writeLibrary(path, characters):
+    # characters is a list of (name, number of shapes, packed records); returns the
+    # temporary file, so the caller decides when it replaces path
+    def write(f):
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(characters)))
+        offset = HEADER.size+len(characters)*INDEX.size
+        for name, count, records in characters:
+            f.write(INDEX.pack(offset, count, encode(name, 32)))
+            offset += len(records)
+        for name, count, records in characters:
+            f.write(records)
+    return atomic.writeTemporary(path, write)
+
+def saveLibrary(path, characters):
+    # characters is a list of (name, shapes)
+    characters = [(name, len(shapes), packCharacter(shapes)) for name, shapes in characters]
+    os.replace(writeLibrary(path, characters), path)
+
+def replaceCharacter(library, index, shapes):
+    # saves shapes as character index of an open library, the other characters are
+    # copied as they are; library is closed, the reopened library is returned
+    path = library.file.name
+    characters = []
+    for i in range(len(library)):
+        if i == index:
+            characters.append((library.name(i), len(shapes), packCharacter(shapes)))
+        else:
+            offset, count, name = library.entry(i)
+            characters.append((decode(name), count, library.data[offset:offset+library.characterSize(i)]))
+    temp = writeLibrary(path, characters)
+    library.close()
+    os.replace(temp, path)
+    return Library(path)
+
+class Library:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('%s is not a scene library' % path)
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.file.close()
+            raise
+        magic, version, flags, self.count = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version > VERSION:
+            self.close()
+            raise ValueError('%s is not a scene library this version can read' % path)
+        if size < HEADER.size+self.count*INDEX.size:
+            self.close()
+            raise ValueError('%s is cut short' % path)
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return INDEX.unpack_from(self.data, HEADER.size+index*INDEX.size)
+
+    def name(self, index):
+        return decode(self.entry(index)[2])
+
+    def characterSize(self, index):
+        # bytes taken by the records of character index
+        offset, count, _ = self.entry(index)
+        size = 0
+        try:
+            for _ in range(count):
+                handles = SHAPE.unpack_from(self.data, offset+size)[2]
+                size += SHAPE.size+handles*HANDLE.size
+        except struct.error:
+            raise ValueError('character %d of %s is cut short' % (index, self.file.name)) from None
+        if offset+size > len(self.data):
+            raise ValueError('character %d of %s is cut short' % (index, self.file.name))
+        return size
+
+    def names(self):
+        return [self.name(i) for i in range(self.count)]
+
+    def load(self, index, types = MODEL_TYPES, table = None):
+        # without a table the shapes of the character share a new one; a damaged
+        # character raises ValueError
+        offset, count, _ = self.entry(index)
+        if table is None:
+            table = model.HandleTable()
+        try:
+            return self.loadShapes(offset, count, types, table)
+        except struct.error:
+            raise ValueError('character %d of %s is cut short' % (index, self.file.name)) from None
+        except KeyError as error:
+            raise ValueError('character %d of %s has an unknown shape or handle %s'
+                             % (index, self.file.name, error)) from None
+            
+    def loadShapes(self, offset, count, types, table):
+        shapes = []
+        for _ in range(count):
+            type_name, name, handles, *attrs = SHAPE.unpack_from(self.data, offset)
+            offset += SHAPE.size
+            shape = types[decode(type_name)](decode(name), table)
+            shape.configure(**dict(zip(shape.attrs, attrs)))
+            for _ in range(handles):
+                name, x, y, canx, cany, minx, maxx, miny, maxy = HANDLE.unpack_from(self.data, offset)
+                offset += HANDLE.size
+                handle = shape.handles[decode(name)]
+                handle.setConstraints(canx, minx, maxx, cany, miny, maxy)
+                # stored positions are restored as they are, constraints are not re-applied
+                handle.x, handle.y = x, y
+                handle.notifyMoved()
+            shapes.append(shape)
+        return shapes
+
+    def close(self):
+        self.data.close()
+        self.file.close()
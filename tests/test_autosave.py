@@ -0,0 +1,79 @@
+import pytest
+
+import autosave
+import model
+import scene
+
+def positions(shapes):
+    return [(handle.name, handle.getState()) for shape in shapes for handle in shape.getHandles()]
+    
+def snapshot(path, shapes):
+    scene.saveLibrary(path+'.fms', [('Head', shapes)])
+    
+def journal(path, records, extra = b''):
+    with open(path+'.journal', 'wb') as f:
+        for index, name, x, y in records:
+            f.write(autosave.RECORD.pack(index, scene.encode(name, 24), x, y))
+        f.write(extra)
+        
+def recover(path):
+    saver = autosave.Autosave(path)
+    try:
+        return saver.recover()
+    finally:
+        saver.close()
+        
+def test_nothing_to_recover(tmp_path):
+    assert recover(str(tmp_path/'autosave')) is None
+    
+def test_journal_is_replayed_over_the_snapshot(tmp_path):
+    path = str(tmp_path/'autosave')
+    head = model.Head('Head')
+    snapshot(path, [head])
+    journal(path, [(0, 'Jaw', 45, 72), (0, 'Chin', 0, 99), (0, 'Jaw', 47, 75)])
+    head.jaw_handle.setState((47, 75))
+    head.chin_handle.setState((0, 99))
+    assert positions(recover(path)) == positions([head])
+    
+def test_record_cut_short_is_ignored(tmp_path):
+    path = str(tmp_path/'autosave')
+    head = model.Head('Head')
+    snapshot(path, [head])
+    # the crash hit halfway through the second record
+    journal(path, [(0, 'Jaw', 45, 72)], autosave.RECORD.pack(0, scene.encode('Chin', 24), 0, 99)[:20])
+    head.jaw_handle.setState((45, 72))
+    assert positions(recover(path)) == positions([head])
+    
+def test_records_for_other_shapes_are_ignored(tmp_path):
+    path = str(tmp_path/'autosave')
+    head = model.Head('Head')
+    snapshot(path, [head])
+    journal(path, [(3, 'Jaw', 45, 72), (0, 'Elbow', 1, 2)])
+    assert positions(recover(path)) == positions([head])
+    
+def test_reset_drops_the_old_journal(tmp_path):
+    path = str(tmp_path/'autosave')
+    saver = autosave.Autosave(path, compact_interval=3600, compact_records=10**6)
+    old, new = model.Head('Old'), model.Head('New')
+    saver.track([old])
+    old.jaw_handle.moveTo(99, 99)
+    saver.track([new])
+    new.chin_handle.moveTo(0, 120)
+    saver.close()
+    shapes = recover(path)
+    assert [shape.name for shape in shapes] == ['New']
+    assert positions(shapes) == positions([new])
+    assert shapes[0].jaw_handle.getState() != (99, 99)
+    
+def test_damaged_snapshot_raises_value_error(tmp_path):
+    # MainFrame.restore reports it and starts with the default shapes
+    path = str(tmp_path/'autosave')
+    snapshot(path, [model.Head('Head')])
+    with open(path+'.fms', 'r+b') as f:
+        f.truncate(40)
+    saver = autosave.Autosave(path)
+    try:
+        with pytest.raises(ValueError):
+            saver.recover()
+    finally:
+        saver.close()
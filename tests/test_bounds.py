@@ -0,0 +1,110 @@
+import math
+
+import pytest
+
+wx = pytest.importorskip('wx')
+import facemap
+
+class Path:
+    # records the points a path reaches instead of drawing it
+    def __init__(self):
+        self.points = []
+        
+    def MoveToPoint(self, x, y):
+        self.points.append((x, y))
+        
+    def AddLineToPoint(self, x, y):
+        self.points.append((x, y))
+        
+    def CloseSubpath(self):
+        pass
+        
+    def AddArc(self, x, y, r, start, end, clockwise):
+        if clockwise:
+            sweep = (end-start) % (2*math.pi)
+        else:
+            sweep = -((start-end) % (2*math.pi))
+        for i in range(33):
+            angle = start+sweep*i/32
+            self.points.append((x+r*math.cos(angle), y+r*math.sin(angle)))
+            
+    def AddEllipse(self, x, y, w, h):
+        self.points += [(x, y), (x+w, y+h)]
+        
+    def AddPath(self, path):
+        self.points += path.points
+        
+    def GetBox(self):
+        xs, ys = [x for x, y in self.points], [y for x, y in self.points]
+        return Box(min(xs), min(ys), max(xs)-min(xs), max(ys)-min(ys))
+        
+class Box:
+    # the attributes of the wx.Rect2D a path box is
+    def __init__(self, x, y, width, height):
+        self.x, self.y, self.width, self.height = x, y, width, height
+        
+class Pen:
+    def IsOk(self):
+        return True
+        
+    def GetWidth(self):
+        return 1
+        
+    def GetColour(self):
+        return wx.Colour(0, 0, 0)
+        
+class Palette:
+    def __getattr__(self, name):
+        return Pen()
+        
+class Context:
+    # collects every point of every path that is stroked or filled
+    def __init__(self):
+        self.points = []
+        
+    def CreatePath(self):
+        return Path()
+        
+    def SetPen(self, pen):
+        pass
+        
+    def SetBrush(self, brush):
+        pass
+        
+    def StrokePath(self, path):
+        self.points += path.points
+        
+    def FillPath(self, path, rule = None):
+        self.points += path.points
+        
+    def DrawPath(self, path, rule = None):
+        self.points += path.points
+        
+def drawnPoints(shape, scale):
+    gc = Context()
+    shape.invalidatePaths()
+    shape.draw(Palette(), gc, True, scale)
+    return gc.points
+    
+def assertInside(shape):
+    x, y, w, h = shape.getBounds()
+    for scale in (1, 0.3, 0.01):
+        for px, py in drawnPoints(shape, scale):
+            assert x-1e-9 <= px <= x+w+1e-9 and y-1e-9 <= py <= y+h+1e-9, (scale, px, py)
+            
+MOVES = [(0, 0), (0, 150), (0, -150), (150, 0), (-150, 0), (120, 120), (-120, -120)]
+
+@pytest.mark.parametrize('name', ['Head Width', 'Jaw', 'Chin Width', 'Chin', 'Eyes', 'Nose', 'Mouth', 'Hairline'])
+@pytest.mark.parametrize('move', MOVES)
+def test_head_paths_inside_bounds(name, move):
+    head = facemap.Head('Head', facemap.HandleTable())
+    # the position is set directly, as undo and library loads do, so constraints do not apply
+    handle = head.handles[name]
+    handle.setState((handle.x+move[0], handle.y+move[1]))
+    assertInside(head)
+    
+@pytest.mark.parametrize('attrs', [{}, {'num_heads': 3}, {'num_heads': 12}, {'size': 40}, {'size': 5}])
+def test_proportion_paths_inside_bounds(attrs):
+    shape = facemap.Proportion('Proportion', facemap.HandleTable())
+    shape.configure(**attrs)
+    assertInside(shape)
@@ -0,0 +1,53 @@
+import math
+
+import pytest
+
+import geometry
+from geometry import Affine
+
+def rotate(px, py, angle, cx = 0, cy = 0):
+    # the formula the shapes used before Affine
+    r = math.radians(angle)
+    return (cx + math.cos(r)*(px-cx) - math.sin(r)*(py-cy),
+            cy + math.sin(r)*(px-cx) + math.cos(r)*(py-cy))
+
+POINTS = [(2.5, 0), (-2.5, 0), (-2.5, 15), (0, 17.5), (3.3, 10), (0, 0), (-7, -3)]
+
+@pytest.fixture(params=['python', 'numpy'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        geometry.loadNumpy()
+        # every batch goes through NumPy
+        monkeypatch.setattr(geometry, 'NUMPY_MIN_POINTS', 0)
+    else:
+        monkeypatch.setattr(geometry, 'numpy', False)
+    return request.param
+
+def assertPoints(actual, expected):
+    assert isinstance(actual, list) and all(type(point) is tuple for point in actual)
+    assert actual == [pytest.approx(point) for point in expected]
+
+@pytest.mark.parametrize('angle, cx, cy', [(-25, 13.3, -50), (90, 0, 0), (33, -4, 7)])
+def test_rotation_matches_rotate(backend, angle, cx, cy):
+    assertPoints(Affine.rotation(angle, cx, cy).transform(POINTS),
+                 [rotate(x, y, angle, cx, cy) for x, y in POINTS])
+
+def test_mirrored_hand_applies_the_mirror_last(backend):
+    # the GraphicsContext chain Scale(-1, 1), Translate(hand), Rotate(-25)
+    hand_x, hand_y = 20, -35
+    hand = Affine.translation(hand_x, hand_y) @ Affine.rotation(-25)
+    expected = []
+    for x, y in POINTS:
+        rx, ry = rotate(x, y, -25)
+        expected.append((-(rx+hand_x), ry+hand_y))
+    assertPoints((Affine.scaling(-1, 1) @ hand).transform(POINTS), expected)
+    assertPoints(hand.transform(POINTS), [(-x, y) for x, y in expected])
+
+def test_composition_matches_applying_in_turn(backend):
+    first, second = Affine.rotation(30, 5, 5), Affine.translation(3, -2) @ Affine.scaling(2, 0.5)
+    assertPoints((second @ first).transform(POINTS), second.transform(first.transform(POINTS)))
+
+def test_apply_matches_transform():
+    transform = Affine.rotation(-25, 13.3, -50)
+    assert [transform.apply(x, y) for x, y in POINTS] == transform.transform(POINTS)
@@ -0,0 +1,63 @@
+import history
+import model
+
+def test_undo_and_redo():
+    handle = model.Handle('Handle', 0, 0)
+    undo = history.History()
+    undo.touch(handle)
+    handle.moveTo(10, 5)
+    assert undo.end()
+    assert undo.undo() == (handle,)
+    assert handle.getState() == (0, 0)
+    assert undo.redo() == (handle,)
+    assert handle.getState() == (10, 5)
+    
+def test_gesture_is_one_entry():
+    a, b = model.Handle('A', 0, 0), model.Handle('B', 0, 0)
+    undo = history.History()
+    for i in range(1, 20):
+        # every motion event touches again, only the first state is kept
+        undo.touch(a)
+        undo.touch(b)
+        a.moveTo(i, 0)
+        b.moveTo(0, i)
+    undo.end()
+    assert len(undo.undo_entries) == 1
+    assert set(undo.undo()) == {a, b}
+    assert a.getState() == b.getState() == (0, 0)
+    assert undo.undo() == ()
+    
+def test_unchanged_gesture_is_not_stored():
+    handle = model.Handle('Handle', 3, 4)
+    undo = history.History()
+    undo.touch(handle)
+    assert not undo.end()
+    assert not undo.undo_entries
+    
+def test_new_edit_clears_redo():
+    handle = model.Handle('Handle', 0, 0)
+    undo = history.History()
+    for x in (1, 2):
+        undo.touch(handle)
+        handle.moveTo(x, 0)
+        undo.end()
+    undo.undo()
+    undo.touch(handle)
+    handle.moveTo(5, 0)
+    undo.end()
+    assert undo.redo() == ()
+    assert handle.getState() == (5, 0)
+    
+def test_oldest_entries_are_dropped():
+    handle = model.Handle('Handle', 0, 0)
+    undo = history.History(max_bytes = 3*(history.ENTRY_OVERHEAD+64))
+    for x in range(1, 11):
+        undo.touch(handle)
+        handle.moveTo(x, 0)
+        undo.end()
+    assert 0 < len(undo.undo_entries) <= 3
+    assert undo.size <= undo.max_bytes
+    while undo.undo():
+        pass
+    # the earliest moves can no longer be undone
+    assert handle.getState()[0] > 0
@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+wx = pytest.importorskip('wx')
+import bench
+import model
+import replay
+from facemap import shapeSpec
+
+KEY = {'t': 0, 'type': 'key', 'mods': '', 'key': wx.WXK_F2}
+WHEEL = {'t': 0, 'type': 'wheel', 'mods': '', 'x': 5, 'y': 5, 'down': '',
+         'rotation': 120, 'delta': 120, 'lines': 3}
+         
+@pytest.fixture(scope='module')
+def app():
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not shutil.which('Xvfb'):
+        pytest.skip('no display')
+    server = bench.ensureDisplay()
+    app = wx.App(False)
+    yield app
+    app.Destroy()
+    if server:
+        server.terminate()
+        
+def test_events_carry_key_and_wheel():
+    key = replay.createEvent(KEY)
+    assert key.GetKeyCode() == wx.WXK_F2
+    wheel = replay.createEvent(dict(WHEEL, mods='C'))
+    assert (wheel.GetWheelRotation(), wheel.GetWheelDelta(), wheel.GetLinesPerAction()) == (120, 120, 3)
+    assert wheel.GetPosition() == (5, 5)
+    assert wheel.ControlDown()
+    
+def test_replay_key_and_wheel(app):
+    header = {'version': 2, 'size': [400, 300], 'panx': 200, 'pany': 150, 'zoom': 1.0,
+              'shaded': False, 'background_image': False, 'gridsize': 10, 'mouse': [5, 5],
+              'image': None, 'shapes': [shapeSpec(model.Head('Head'))]}
+    result = replay.replay(header, [KEY, WHEEL])
+    assert result['events'] == 2
+    # F2 toggled shading, the wheel over empty space zoomed in by one step
+    assert result['view']['shaded'] is True
+    assert result['view']['zoom'] == pytest.approx(1.1)
@@ -0,0 +1,100 @@
+import pytest
+
+import model
+import scene
+
+def character():
+    head = model.Head('Head')
+    head.jaw_handle.moveTo(45, 72)
+    head.eyes_handle.setConstraints(miny=10, maxy=40)
+    body = model.Proportion('Body')
+    body.configure(size=30, num_heads=7)
+    return [head, body]
+    
+def handles(shapes):
+    return [(handle.name, handle.getState(), handle.canx, handle.cany, handle.minx, handle.maxx, handle.miny, handle.maxy)
+            for shape in shapes for handle in shape.getHandles()]
+            
+def test_round_trip(tmp_path):
+    path = str(tmp_path/'scene.fms')
+    shapes = character()
+    scene.saveLibrary(path, [('First', shapes), ('Second', [model.Head('Other')])])
+    library = scene.Library(path)
+    try:
+        assert library.names() == ['First', 'Second']
+        loaded = library.load(0)
+        assert [(type(shape), shape.name) for shape in loaded] == [(model.Head, 'Head'), (model.Proportion, 'Body')]
+        assert handles(loaded) == handles(shapes)
+        assert (loaded[1].size, loaded[1].num_heads) == (30, 7)
+        # the shapes of one character share a table
+        assert loaded[0].table is loaded[1].table
+    finally:
+        library.close()
+        
+def test_stored_positions_are_not_clamped(tmp_path):
+    path = str(tmp_path/'scene.fms')
+    head = model.Head('Head')
+    head.head_handle.setConstraints(cany=False, minx=10, maxx=60)
+    head.head_handle.setState((80, 0))
+    scene.saveLibrary(path, [('Head', [head])])
+    library = scene.Library(path)
+    try:
+        assert library.load(0)[0].head_handle.getState() == (80, 0)
+    finally:
+        library.close()
+        
+def test_replace_character_keeps_the_others(tmp_path):
+    path = str(tmp_path/'scene.fms')
+    first, second = character(), [model.Head('Other')]
+    scene.saveLibrary(path, [('First', first), ('Second', second)])
+    changed = model.Head('Changed')
+    changed.chin_handle.moveTo(0, 110)
+    library = scene.replaceCharacter(scene.Library(path), 1, [changed])
+    try:
+        assert library.names() == ['First', 'Second']
+        assert handles(library.load(0)) == handles(first)
+        assert handles(library.load(1)) == handles([changed])
+    finally:
+        library.close()
+        
+def test_too_long_name_leaves_no_files(tmp_path):
+    path = tmp_path/'scene.fms'
+    with pytest.raises(ValueError):
+        scene.saveLibrary(str(path), [('x'*33, character())])
+    assert list(tmp_path.iterdir()) == []
+    
+def test_rejects_other_files(tmp_path):
+    path = tmp_path/'other.fms'
+    path.write_bytes(b'\0'*64)
+    with pytest.raises(ValueError):
+        scene.Library(str(path))
+    
+@pytest.mark.parametrize('size', [0, 3, scene.HEADER.size+5])
+def test_rejects_truncated_files(tmp_path, size):
+    path = tmp_path/'scene.fms'
+    scene.saveLibrary(str(path), [('First', character())])
+    path.write_bytes(path.read_bytes()[:size])
+    with pytest.raises(ValueError):
+        scene.Library(str(path))
+        
+def test_damaged_character_raises_value_error(tmp_path):
+    path = tmp_path/'scene.fms'
+    scene.saveLibrary(str(path), [('First', character())])
+    data = path.read_bytes()
+    path.write_bytes(data[:-10])
+    library = scene.Library(str(path))
+    try:
+        with pytest.raises(ValueError):
+            library.load(0)
+        with pytest.raises(ValueError):
+            library.characterSize(0)
+    finally:
+        library.close()
+    # a shape type this program does not know
+    path.write_bytes(data.replace(b'Proportion', b'Unknown\0\0\0'))
+    library = scene.Library(str(path))
+    try:
+        with pytest.raises(ValueError):
+            library.load(0)
+    finally:
+        library.close()
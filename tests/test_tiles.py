@@ -0,0 +1,75 @@
+import os
+import struct
+
+import pytest
+
+import tiles
+
+def pixels(w, h, seed):
+    return bytes((seed+i*7) % 251 for i in range(w*h*3))
+
+def crop(rgb, w, x0, y0, tw, th):
+    return b''.join(rgb[(y*w+x0)*3:(y*w+x0+tw)*3] for y in range(y0, y0+th))
+
+def test_round_trip_with_edge_tiles_and_levels(tmp_path):
+    # 10x7 in tiles of 4 leaves partial tiles on the right and bottom edges
+    levels = [(10, 7, pixels(10, 7, 0)), (5, 3, pixels(5, 3, 1)), (2, 1, pixels(2, 1, 2))]
+    store = tiles.TileStore.create(str(tmp_path/'image.tiles'), levels, 4)
+    try:
+        assert (store.width, store.height, store.tile) == (10, 7, 4)
+        assert store.levels == [(10, 7), (5, 3), (2, 1)]
+        for level, (w, h, rgb) in enumerate(levels):
+            cols, rows = store.tileCount(level)
+            assert (cols, rows) == (-(-w//4), -(-h//4))
+            for ty in range(rows):
+                for tx in range(cols):
+                    tw, th = min(4, w-tx*4), min(4, h-ty*4)
+                    assert store.tileData(level, tx, ty) == (tw, th, crop(rgb, w, tx*4, ty*4, tw, th))
+    finally:
+        store.close()
+    assert os.listdir(str(tmp_path)) == ['image.tiles']
+
+def test_failed_write_leaves_no_files(tmp_path):
+    # no pixels at all for a 4x4 level
+    with pytest.raises(IndexError):
+        tiles.TileStore.create(str(tmp_path/'image.tiles'), [(4, 4, memoryview(b''))], 4)
+    assert os.listdir(str(tmp_path)) == []
+
+def png(w, h):
+    return b'\x89PNG\r\n\x1a\n'+struct.pack('>I', 13)+b'IHDR'+struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)
+
+def jpeg(w, h):
+    app0 = b'\xff\xe0'+struct.pack('>H', 16)+b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+    # fill bytes before a marker are allowed
+    sof = b'\xff\xff\xc2'+struct.pack('>HBHHB', 11, 8, h, w, 1)+b'\x01\x11\0'
+    return b'\xff\xd8'+app0+sof
+
+@pytest.mark.parametrize('data, size', [
+    (png(9000, 7000), (9000, 7000)),
+    (jpeg(12000, 8000), (12000, 8000)),
+    (b'GIF89a'+struct.pack('<HH', 640, 480), (640, 480)),
+    (b'BM'+bytes(16)+struct.pack('<ii', 300, -200), (300, 200)),
+    (b'not an image', None),
+    (b'\xff\xd8\xff\xe0', None),
+])
+def test_image_size_from_header(tmp_path, data, size):
+    path = tmp_path/'image'
+    path.write_bytes(data)
+    assert tiles.imageSize(str(path)) == size
+
+def test_prune_keeps_the_most_recent_within_budget(tmp_path):
+    for i, name in enumerate(['a', 'b', 'c', 'd']):
+        path = tmp_path/(name+'.tiles')
+        path.write_bytes(bytes(100))
+        os.utime(str(path), (1000+i, 1000+i))
+    stale = tmp_path/'a.tiles.123.tmp'
+    stale.write_bytes(bytes(10))
+    os.utime(str(stale), (0, 0))
+    (tmp_path/'other').write_bytes(bytes(1000))
+    tiles.pruneCache(str(tmp_path), 250)
+    assert sorted(os.listdir(str(tmp_path))) == ['c.tiles', 'd.tiles', 'other']
+
+def test_prune_keeps_the_newest_file_over_budget(tmp_path):
+    (tmp_path/'a.tiles').write_bytes(bytes(100))
+    tiles.pruneCache(str(tmp_path), 10)
+    assert os.listdir(str(tmp_path)) == ['a.tiles']
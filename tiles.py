@@ -0,0 +1,173 @@
+'''
+On-disk tile cache for very large reference images.
+
+The decoded RGB pixels of every level of a mip chain are written once into a
+cache file, split into square tiles. The file is memory-mapped, so reading a
+tile only touches the pages it covers and the operating system decides how
+much of the image stays in memory.
+
+Layout: a header, the size of each level, then the tiles of level 0, level 1,
+... row by row. Every tile has a slot of tile*tile*3 bytes, edge tiles only
+use the start of theirs.
+'''
+
+import mmap
+import os
+import struct
+import time
+
+import atomic
+
+MAGIC = b'FMT1'
+HEADER = struct.Struct('<4sIII')
+LEVEL = struct.Struct('<II')
+
+def tileCount(w, h, tile):
+    # columns and rows of tiles needed to cover w x h pixels
+    return -(-w//tile), -(-h//tile)
+
+def imageSize(path):
+    # width and height from the header of a PNG, JPEG, GIF or BMP file without
+    # decoding it, None for anything else
+    with open(path, 'rb') as f:
+        head = f.read(26)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:2] == b'BM' and len(head) >= 26:
+            w, h = struct.unpack('<ii', head[18:26])
+            return w, abs(h)
+        if head[:2] != b'\xff\xd8':
+            return None
+        # JPEG: walk the segments up to the start of frame
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            if marker[1] == 0xff:
+                # fill byte, the marker starts at the second one
+                f.seek(-1, os.SEEK_CUR)
+                continue
+            if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd7:
+                # markers without a length
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            length, = struct.unpack('>H', length)
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                h, w = struct.unpack('>HH', frame[1:5])
+                return w, h
+            f.seek(length-2, os.SEEK_CUR)
+
+def pruneCache(directory, budget, suffix = '.tiles', stale = 24*3600):
+    # deletes the least recently used cache files until the rest fit in budget
+    # bytes; temporary files older than stale seconds were left by a crash
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    now = time.time()
+    files, delete = [], []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if entry.name.endswith(suffix):
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        elif entry.name.endswith('.tmp') and now-stat.st_mtime > stale:
+            delete.append(entry.path)
+    # newest first, everything past the budget goes but the newest file
+    files.sort(reverse=True)
+    total = 0
+    for i, (mtime, size, path) in enumerate(files):
+        total += size
+        if total > budget and i:
+            delete.append(path)
+    for path in delete:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+class TileStore:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # the modification time orders the cache files for pruneCache
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        magic, self.width, self.height, self.tile = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a tile cache' % path)
+        count, = struct.unpack_from('<I', self.data, HEADER.size)
+        self.levels = [LEVEL.unpack_from(self.data, HEADER.size+4+i*LEVEL.size) for i in range(count)]
+        # index of the first tile of each level
+        self.first = []
+        n = 0
+        for w, h in self.levels:
+            self.first.append(n)
+            cols, rows = tileCount(w, h, self.tile)
+            n += cols*rows
+        self.offset = HEADER.size+4+count*LEVEL.size
+
+    @classmethod
+    def create(cls, path, levels, tile = 256):
+        # levels is a list of (width, height, rgb) with rows of width*3 bytes, largest first
+        slot = tile*tile*3
+        count = sum(cols*rows for cols, rows in (tileCount(w, h, tile) for w, h, _ in levels))
+        offset = HEADER.size+4+len(levels)*LEVEL.size
+        atomic.writeReplacing(path, lambda f: cls.write(f, levels, tile, offset, count*slot))
+        return cls(path)
+
+    @staticmethod
+    def write(f, levels, tile, offset, size):
+        slot = tile*tile*3
+        f.truncate(offset+size)
+        with mmap.mmap(f.fileno(), 0) as data:
+            HEADER.pack_into(data, 0, MAGIC, levels[0][0], levels[0][1], tile)
+            struct.pack_into('<I', data, HEADER.size, len(levels))
+            for i, (w, h, _) in enumerate(levels):
+                LEVEL.pack_into(data, HEADER.size+4+i*LEVEL.size, w, h)
+            pos = offset
+            for w, h, rgb in levels:
+                rgb = memoryview(rgb)
+                cols, rows = tileCount(w, h, tile)
+                for ty in range(rows):
+                    for tx in range(cols):
+                        x0, y0 = tx*tile, ty*tile
+                        tw, th = min(tile, w-x0), min(tile, h-y0)
+                        out = pos
+                        for y in range(y0, y0+th):
+                            start = (y*w+x0)*3
+                            data[out:out+tw*3] = rgb[start:start+tw*3]
+                            out += tw*3
+                        pos += slot
+
+    def tileCount(self, level):
+        w, h = self.levels[level]
+        return tileCount(w, h, self.tile)
+
+    def tileSize(self, level, tx, ty):
+        w, h = self.levels[level]
+        return min(self.tile, w-tx*self.tile), min(self.tile, h-ty*self.tile)
+
+    def tileData(self, level, tx, ty):
+        # width, height and rgb bytes of one tile, rows of width*3 bytes
+        w, h = self.tileSize(level, tx, ty)
+        cols, _ = self.tileCount(level)
+        start = self.offset+(self.first[level]+ty*cols+tx)*self.tile*self.tile*3
+        return w, h, self.data[start:start+w*h*3]
+
+    def close(self):
+        self.data.close()
+        self.file.close()